@@ -0,0 +1,367 @@
+#!/usr/bin/python3
+"""
+  Benchmarks for the controller, fixtures and outputs.
+
+  Drives DMXController with rigs of 2, 50 and 500 PAR fixtures, every
+  universe a DMXConnection writing to a pseudo-terminal widget (FakeWidget).
+  MQTT commands come from an in-process injector and sACN from a synthetic
+  two-source generator, so nothing outside the process is needed beyond
+  the packages dmx-mqtt.py itself imports.
+
+  Scenarios:
+    render   colour changes rendered and written, one frame each
+    mqtt     JSON commands through on_message and the writer queue: a
+             burst for throughput, then a steady stream for latency
+    sacn     packets through the merge, coalescer and input patch
+    effect   a software colour loop on the effect engine
+
+  Every scenario runs --repeat times and each metric keeps its median.
+  Results are machine-readable (JSON) and compared against a saved
+  baseline; anything worse than the baseline by more than the tolerance
+  is a regression and the run exits non-zero. Baselines only mean anything
+  on the machine they were saved on.
+
+  Run from bin/, like dmx-mqtt.py:
+    ./benchmark.py                 run and compare with benchmark.json
+    ./benchmark.py --save          run and save as the new baseline
+    ./benchmark.py --quick         fewer iterations, for a smoke test
+    ./benchmark.py --fixtures 50   one rig size only
+"""
+
+import argparse, configparser, gc, importlib.util, json, math, os, platform
+import random, sys, threading, time, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import pysimpledmx.backends as backends
+
+# dmx-mqtt.py is a script, not a module name python can import
+spec = importlib.util.spec_from_file_location('dmxmqtt', os.path.join(HERE, 'dmx-mqtt.py'))
+dmxmqtt = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(dmxmqtt)
+
+BASELINE = os.path.join(HERE, 'benchmark.json')
+PROFILES = os.path.join(HERE, '..', 'config', 'fixtures')
+FIXTURES = (2, 50, 500)
+PAR_SIZE = 7
+PER_UNIVERSE = 512 // PAR_SIZE
+
+# which way is better for every metric measured
+METRICS = {
+   'fps': 'higher',
+   'commands_per_sec': 'higher',
+   'packets_per_sec': 'higher',
+   'cpu_ms_per_frame': 'lower',
+   'cpu_ms_per_command': 'lower',
+   'cpu_ms_per_packet': 'lower',
+   'cpu_ms_per_tick': 'lower',
+   'alloc_bytes_per_frame': 'lower',
+   'retained_blocks_per_frame': 'lower',
+   'latency_p50_ms': 'lower',
+   'latency_p95_ms': 'lower',
+   'latency_p99_ms': 'lower',
+}
+
+#
+# Rig: a controller patched with count PARs over as many pty widgets as needed
+#
+class Rig:
+   def close(self):
+      self.controller.call(self.controller.stopEffect)
+      self.controller.mydmx.close()
+      for widget in self.widgets:
+         widget.close()
+
+   # Wait for every queued command to be applied and its frame written
+   # The first call can land in the last batch, which is only rendered once
+   # every command in it is done; the second is in a batch of its own.
+   def settle(self):
+      self.controller.call(lambda: None)
+      self.controller.call(lambda: None)
+
+   def __init__(self, count):
+      universes = max(1, math.ceil(count / PER_UNIVERSE))
+      self.widgets = [backends.FakeWidget() for universe in range(universes)]
+      self.names = ['par%d' % index for index in range(count)]
+      settings = {
+         'fixtures': {'profiles': PROFILES},
+         'effects': {'software': 'true'},
+         'patch': {name: 'par %d %d' % (index % PER_UNIVERSE * PAR_SIZE, index // PER_UNIVERSE + 1)
+               for index, name in enumerate(self.names)},
+         'groups': {'all': ' '.join(self.names)},
+         'sacn': {'universe': '1', 'wall': 'rgb 1 all'},
+      }
+      for universe, widget in enumerate(self.widgets, 1):
+         section = 'dmx' if universe == 1 else 'dmx.%d' % universe
+         settings[section] = {'output': 'enttec', 'port': widget.port}
+      self.config = configparser.ConfigParser()
+      self.config.read_dict(settings)
+      self.controller = dmxmqtt.DMXController(self.config)
+      self.controller.call(self.controller.patch, self.config)
+      self.controller.call(self.controller.render)
+
+#
+# MQTT injector: messages and a client shaped like paho's and mymqtt's
+#
+class Message:
+   __slots__ = ('payload',)
+
+   def __init__(self, payload):
+      self.payload = payload
+
+class Client:
+   def update_state(self, status):
+      self.updates += 1
+
+   def __init__(self):
+      self.updates = 0
+
+def commands(count, seed=1):
+   """ A reproducible mix of colour, brightness, state and scene commands. """
+   chance = random.Random(seed)
+   scenes = ('police', 'movie', 'night', 'reset')
+   messages = []
+   for index in range(count):
+      kind = chance.random()
+      if kind < 0.6:
+         params = {'state': 'ON', 'color': {'r': chance.randrange(256),
+               'g': chance.randrange(256), 'b': chance.randrange(256)}}
+      elif kind < 0.8:
+         params = {'brightness': chance.randrange(1, 256)}
+      elif kind < 0.9:
+         params = {'effect': chance.choice(scenes)}
+      else:
+         params = {'state': chance.choice(('ON', 'OFF'))}
+      messages.append(Message(json.dumps(params).encode('utf-8')))
+   return messages
+
+#
+# sACN generator: packets shaped like sacn.DataPacket from two sources
+#
+class Packet:
+   __slots__ = ('cid', 'sourceName', 'priority', 'universe', 'dmxData', 'option_StreamTerminated')
+
+   def __init__(self, cid, name, data, priority=100, universe=1):
+      self.cid = cid
+      self.sourceName = name
+      self.priority = priority
+      self.universe = universe
+      self.dmxData = data
+      self.option_StreamTerminated = False
+
+def packets(count, seed=1):
+   """ A desk and a backup desk, each moving a few slots per packet. """
+   chance = random.Random(seed)
+   levels = {'desk': [0] * 512, 'backup': [0] * 512}
+   result = []
+   for index in range(count):
+      name = 'desk' if index % 2 == 0 else 'backup'
+      data = levels[name]
+      for change in range(8):
+         data[chance.randrange(512)] = chance.randrange(256)
+      result.append(Packet(name.encode(), name, tuple(data)))
+   return result
+
+def percentiles(controller):
+   report = controller.latency.report()
+   return {'latency_p%d_ms' % p: report['latency_total_p%d' % p] for p in (50, 95, 99)}
+
+#
+# Scenarios; each returns a dict of metrics
+#
+def benchRender(rig, frames):
+   controller = rig.controller
+   colors = [(index * 7 % 256, index * 13 % 256, index * 29 % 256) for index in range(frames)]
+   for color in colors[:10]:
+      controller.call(controller.renderRGB, *color)
+   gc.collect()
+   blocks = sys.getallocatedblocks()
+   cpu = time.process_time()
+   start = time.perf_counter()
+   for color in colors:
+      controller.call(controller.renderRGB, *color)
+   elapsed = time.perf_counter() - start
+   cpu = time.process_time() - cpu
+   blocks = sys.getallocatedblocks() - blocks
+   # transient allocation: the peak above where each frame started
+   samples = colors[:max(10, frames // 10)]
+   tracemalloc.start()
+   allocated = 0
+   for color in samples:
+      tracemalloc.reset_peak()
+      before = tracemalloc.get_traced_memory()[0]
+      controller.call(controller.renderRGB, *color)
+      allocated += tracemalloc.get_traced_memory()[1] - before
+   tracemalloc.stop()
+   return {
+      'fps': round(frames / elapsed, 1),
+      'cpu_ms_per_frame': round(cpu * 1000 / frames, 4),
+      'alloc_bytes_per_frame': round(allocated / len(samples)),
+      'retained_blocks_per_frame': round(max(blocks, 0) / frames, 3),
+   }
+
+def benchMQTT(rig, count, steady):
+   controller = rig.controller
+   client = Client()
+   messages = commands(count)
+   rig.settle()
+   cpu = time.process_time()
+   start = time.perf_counter()
+   injector = threading.Thread(target=lambda: [controller.on_message(client, message)
+         for message in messages])
+   injector.start()
+   injector.join()
+   rig.settle()
+   elapsed = time.perf_counter() - start
+   cpu = time.process_time() - cpu
+   result = {
+      'commands_per_sec': round(count / elapsed, 1),
+      'cpu_ms_per_command': round(cpu * 1000 / count, 4),
+   }
+   # latency is taken from a steady 200 commands a second, not the burst,
+   # which would only measure how long the queue takes to drain
+   controller.latency.report()
+   deadline = time.perf_counter()
+   for message in commands(steady, seed=2):
+      controller.on_message(client, message)
+      deadline += 1.0 / 200
+      delay = deadline - time.perf_counter()
+      if delay > 0:
+         time.sleep(delay)
+   rig.settle()
+   result.update(percentiles(controller))
+   return result
+
+def benchSACN(rig, count):
+   controller = rig.controller
+   # the receive path main() wires to the sACN receiver
+   sacninput = dmxmqtt.SACNInput(controller, rig.config)
+   inputs = sacninput.inputs
+   generated = packets(count)
+   rig.settle()
+   controller.latency.report()
+   cpu = time.process_time()
+   start = time.perf_counter()
+   # sent at twice a 44Hz desk's rate per source, so coalescing has work to do
+   interval = 1.0 / 176
+   deadline = start
+   for packet in generated:
+      sacninput.receive(packet)
+      deadline += interval
+      delay = deadline - time.perf_counter()
+      if delay > 0:
+         time.sleep(delay)
+   time.sleep(2 * inputs.interval)
+   rig.settle()
+   elapsed = time.perf_counter() - start
+   cpu = time.process_time() - cpu
+   result = {
+      'packets_per_sec': round(count / elapsed, 1),
+      'cpu_ms_per_packet': round(cpu * 1000 / count, 4),
+   }
+   result.update(percentiles(controller))
+   result.update(inputs.counters())
+   return result
+
+def benchEffect(rig, seconds):
+   controller = rig.controller
+   controller.call(controller.setScene, 'colorloop')
+   engine = controller.effects
+   ticks, busy = engine.ticks, engine.busy
+   cpu = time.process_time()
+   time.sleep(seconds)
+   cpu = time.process_time() - cpu
+   ticks, busy = engine.ticks - ticks, engine.busy - busy
+   controller.call(controller.stopEffect)
+   return {
+      'ticks': ticks,
+      'overruns': engine.overruns,
+      'cpu_ms_per_tick': round(cpu * 1000 / max(ticks, 1), 4),
+      'busy_ms_per_tick': round(busy * 1000 / max(ticks, 1), 4),
+   }
+
+# Median of each metric over the repeated runs
+def median(runs):
+   return {metric: sorted(run[metric] for run in runs)[len(runs) // 2] for metric in runs[0]}
+
+def run(counts, quick=False, repeat=3):
+   scale = 0.1 if quick else 1
+   results = {}
+   for count in counts:
+      # bigger rigs take longer per frame, so do fewer of them
+      work = max(0.1, min(1.0, 20.0 / count)) * scale
+      scenarios = (
+         ('render', lambda rig: benchRender(rig, max(20, int(2000 * work)))),
+         ('mqtt', lambda rig: benchMQTT(rig, max(20, int(5000 * work)), int(200 * scale))),
+         ('sacn', lambda rig: benchSACN(rig, int(880 * scale))),
+         ('effect', lambda rig: benchEffect(rig, scale)),
+      )
+      rig = Rig(count)
+      try:
+         for name, scenario in scenarios:
+            results.setdefault(name, {})[str(count)] = median([scenario(rig) for index in range(repeat)])
+      finally:
+         rig.close()
+   return results
+
+# Metrics worse than the baseline by more than tolerance (a fraction)
+def regressions(results, baseline, tolerance):
+   found = []
+   for scenario, sizes in baseline.items():
+      for count, metrics in sizes.items():
+         current = results.get(scenario, {}).get(count)
+         if current is None:
+            continue
+         for metric, before in metrics.items():
+            better = METRICS.get(metric)
+            after = current.get(metric)
+            if better is None or after is None or not before:
+               continue
+            change = (after - before) / before
+            if (better == 'higher' and change < -tolerance) or (better == 'lower' and change > tolerance):
+               found.append('%s/%s %s: %s -> %s (%+.0f%%)' % (scenario, count, metric, before, after, change * 100))
+   return found
+
+def machine():
+   return {'python': platform.python_version(), 'platform': platform.platform(),
+           'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark the DMX controller.')
+   parser.add_argument('--fixtures', type=int, action='append', help='rig size (repeatable)')
+   parser.add_argument('--quick', action='store_true', help='fewer iterations')
+   parser.add_argument('--repeat', type=int, default=3, help='runs of each scenario (default 3)')
+   parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+   parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+   parser.add_argument('--output', help='also write the results to this file')
+   parser.add_argument('--tolerance', type=float, default=0.3,
+         help='allowed fraction worse than the baseline (default 0.3)')
+   args = parser.parse_args()
+
+   report = {'machine': machine(), 'quick': args.quick,
+             'results': run(args.fixtures or FIXTURES, args.quick, args.repeat)}
+   print(json.dumps(report, indent=2))
+   if args.output:
+      with open(args.output, 'w') as out:
+         json.dump(report, out, indent=2)
+   if args.save:
+      with open(args.baseline, 'w') as out:
+         json.dump(report, out, indent=2)
+      return 0
+   if not os.path.exists(args.baseline):
+      print('No baseline at %s; run with --save to make one.' % args.baseline)
+      return 0
+   with open(args.baseline) as saved:
+      baseline = json.load(saved)
+   if baseline.get('machine') != report['machine']:
+      print('Baseline was saved on a different machine; comparing anyway.')
+   if baseline.get('quick') != args.quick:
+      print('Baseline was saved with a different --quick setting; comparing anyway.')
+   found = regressions(report['results'], baseline['results'], args.tolerance)
+   for line in found:
+      print('REGRESSION ' + line)
+   return 1 if found else 0
+
+if __name__ == '__main__':
+   sys.exit(main())
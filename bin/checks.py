@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+  Regression checks for behaviour that is easy to break without noticing.
+
+  Plain unittest cases; nothing outside the process is needed beyond the
+  packages the code under test imports. The controller checks drive
+  DMXController on NullOutputs and look at every frame sent.
+
+  Run from bin/, like dmx-mqtt.py:
+    ./checks.py                    every check
+    ./checks.py MergeChecks        one group
+"""
+
+import configparser, importlib.util, json, os, sys, time, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import lib.sacnmerge as sacnmerge
+
+PROFILES = os.path.join(HERE, '..', 'config', 'fixtures')
+PAR_SIZE = 7
+RED = 4        # offset of the red channel in a PAR
+
+dmxmqtt = None
+
+def controller(count):
+   """ A DMXController with count PARs on one NullOutput, sending at 2kHz. """
+   global dmxmqtt
+   if dmxmqtt is None:
+      # dmx-mqtt.py is a script, not a module name python can import
+      spec = importlib.util.spec_from_file_location('dmxmqtt', os.path.join(HERE, 'dmx-mqtt.py'))
+      dmxmqtt = importlib.util.module_from_spec(spec)
+      spec.loader.exec_module(dmxmqtt)
+   config = configparser.ConfigParser()
+   config.read_dict({
+      'dmx': {'output': 'null', 'rate': '2000'},
+      'fixtures': {'profiles': PROFILES},
+      'patch': {'par%d' % index: 'par %d' % (index * PAR_SIZE) for index in range(count)},
+   })
+   control = dmxmqtt.DMXController(config)
+   control.call(control.patch, config)
+   control.call(control.render)
+   return control
+
+def record(output):
+   """ Every frame output sends from now on, as a list of bytes. """
+   frames = []
+   output.written = lambda: frames.append(bytes(output.last[:output.last_size]))
+   return frames
+
+class Message:
+   def __init__(self, params):
+      self.payload = json.dumps(params).encode()
+
+class Client:
+   def update_state(self, status):
+      pass
+
+#
+# sACN merge: htp, ltp and priority
+#
+class MergeChecks(unittest.TestCase):
+
+   def merge(self, mode):
+      return sacnmerge.MergeEngine(mode, timeout=2.5, size=4)
+
+   def test_htp_takes_the_highest_level(self):
+      merge = self.merge('htp')
+      merge.update('a', [10, 10, 0, 0], now=0)
+      self.assertTrue(merge.update('b', [0, 20, 5, 5], now=0.1))
+      self.assertEqual(bytes(merge.levels), bytes([10, 20, 5, 5]))
+      # b backing off hands the slot back to a
+      merge.update('b', [0, 0, 5, 5], now=0.2)
+      self.assertEqual(bytes(merge.levels), bytes([10, 10, 5, 5]))
+
+   def test_ltp_joining_source_takes_its_first_frame(self):
+      merge = self.merge('ltp')
+      merge.update('a', [10, 10, 0, 0], now=0)
+      self.assertTrue(merge.update('b', [0, 0, 5, 5], now=0.1))
+      self.assertEqual(bytes(merge.levels), bytes([0, 0, 5, 5]))
+      # after that only the slots a source changes move
+      merge.update('a', [10, 30, 0, 0], now=0.2)
+      self.assertEqual(bytes(merge.levels), bytes([0, 30, 5, 5]))
+
+   def test_ltp_static_backup_takes_over(self):
+      merge = self.merge('ltp')
+      merge.update('main', [50, 50, 50, 50], now=0)
+      merge.update('backup', [0, 0, 0, 0], priority=90, now=0)
+      self.assertEqual(bytes(merge.levels), bytes([50, 50, 50, 50]))
+      # the backup desk holds a static cue and raises its priority
+      self.assertTrue(merge.update('backup', [0, 0, 0, 0], priority=110, now=0.1))
+      self.assertEqual(bytes(merge.levels), bytes(4))
+
+   def test_priority_excludes_lower_sources(self):
+      merge = self.merge('htp')
+      merge.update('low', [200, 200, 200, 200], priority=50, now=0)
+      merge.update('high', [1, 2, 3, 4], priority=150, now=0)
+      self.assertEqual(bytes(merge.levels), bytes([1, 2, 3, 4]))
+      # the low source changing is ignored until high goes quiet
+      self.assertFalse(merge.update('low', [100, 100, 100, 100], priority=50, now=1))
+      self.assertTrue(merge.expire(now=2.8))
+      self.assertEqual(bytes(merge.levels), bytes([100, 100, 100, 100]))
+
+#
+# Output: only whole rendered frames reach the wire
+#
+class OutputChecks(unittest.TestCase):
+   count = 70
+
+   def setUp(self):
+      # switch threads as often as possible, so a torn frame shows up
+      self.interval = sys.getswitchinterval()
+      sys.setswitchinterval(1e-6)
+      self.controller = controller(self.count)
+      self.output = self.controller.mydmx[1]
+      self.client = Client()
+
+   def tearDown(self):
+      sys.setswitchinterval(self.interval)
+      self.controller.mydmx.close()
+
+   def reds(self, frame):
+      return set(frame[index * PAR_SIZE + RED] for index in range(self.count))
+
+   def test_commands_are_sent_whole(self):
+      frames = record(self.output)
+      for index in range(200):
+         color = {'r': index * 37 % 256, 'g': 0, 'b': 0}
+         self.controller.on_message(self.client, Message({'color': color, 'state': 'ON'}))
+         time.sleep(0.001)
+      self.controller.call(lambda: None)
+      time.sleep(0.05)
+      self.assertTrue(frames)
+      torn = [frame for frame in frames if len(self.reds(frame)) > 1]
+      self.assertEqual(len(torn), 0, '%d of %d frames mix two commands' % (len(torn), len(frames)))
+
+   def test_fade_never_sends_its_target_first(self):
+      # the target can only leak as the fade is set up, so set up a few
+      params = {'color': {'r': 255, 'g': 0, 'b': 0}, 'state': 'ON', 'transition': 0.2}
+      for attempt in range(10):
+         self.controller.call(self.controller.off)
+         time.sleep(0.02)
+         frames = record(self.output)
+         self.controller.on_message(self.client, Message(params))
+         time.sleep(0.3)
+         reds = [frame[RED] for frame in frames]
+         self.assertTrue(reds)
+         self.assertEqual(reds[-1], 255)
+         early = reds[:len(reds) // 2].count(255)
+         self.assertEqual(early, 0, '%d of the first %d frames are already at the target'
+               % (early, len(reds) // 2))
+
+if __name__ == '__main__':
+   unittest.main()
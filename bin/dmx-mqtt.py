@@ -1,233 +1,357 @@
 #!/usr/bin/python3
 
 import pysimpledmx.pysimpledmx as pysimpledmx
-import webcolors, colorsys
-import sys, configparser
+import pysimpledmx.backends as backends
+import pysimpledmx.universes as universes
+import pysimpledmx.recorder as recorder
+import webcolors
+import sys, configparser, contextlib, threading, queue, traceback
+from concurrent.futures import Future
 import simplejson as json
 import lib.mymqtt as mymqtt
+import lib.fixtures as fixturelib
+import lib.fixturearray as fixturearray
+import lib.effects as effects
+import lib.fades as fades
+import lib.scenes as scenes
+import lib.inputpatch as inputpatch
+import lib.sacnmerge as sacnmerge
+import lib.coalesce as coalesce
+import lib.latency as latency
 import sacn
 
-# 
-# Clamp values between a range - inclusive
-#
-def clamp(n, smallest=0, largest=255): return max(smallest, min(n, largest))
-
-#
-# Convert HSV in PERCENT (not DEGREES) to RGB (0..255)
-#
-def hsv_to_rgb(h, s, v):
-   # colorsys only does floats from 0 to 1 for all inputs and outputs
-   # smartthings only reports h,s,v as a percent 0 to 100
-   # convert smartthings percent to float
-   h = float(h)/100.0
-   s = float(s)/100.0
-   v = float(v)/100.0
-   r, g, b = colorsys.hsv_to_rgb(h, s, v)
-   # convert to r,g,b web space (0-255)
-   r = int(r*255.0)
-   g = int(g*255.0)
-   b = int(b*255.0)
-   return (r, g, b)
-
-#
-# ParFixture
-# 
-# LED PAR DMX Channels:
-# 1 - master dimming - 0 (dark) to 255 (light)
-# 2 - master strobe - 0 (slow) to 255 (fast)
-# 3 - function
-#    DMX 8 control    0 - 50
-#    Jumping change     51-100
-#    Gradual change    101-150
-#    Pulse change   151-200
-#    Sound control    201-255 (does not work)
-# 4 - function speed - 0 (slow) to 255 (fast)
-# 5 - Red dimming
-# 6 - Green dimming
-# 7 - Blue dimming
-#
-# Each channel mapped to an attribute.
-#
-class ParFixture:
-   mydmx = 0 # controller handle
-   channel = 0 # fixture channel
-
-   # all the keys will be initialized as class attributes
-   allowed_keys = set(['dimmer','strobe','function', 'speed',
-            'red', 'blue', 'green'])
-
-   # map DMX values for fixture function to labels
-   fixtureFunction = {0: 0, 'dmx': 0, 'jump': 55, 'gradual': 105,
-            'pulse': 155, 'sound': 205 }
-
-   # Set all attributes to 0
-   def reset(self):
-      self.__dict__.update((key, 0) for key in self.allowed_keys)
-      self.effect = ''
-
-   # Fixture Off
-   def off(self):
-      self.reset()
-      self.setChannel()
-   
-   # Shortcut to set all attributes from a dict
-   def setParams(self, **kwargs):
-      # and update the given keys by their given values
-      self.__dict__.update((key, value) for key, value in kwargs.items() if key in self.allowed_keys)
-      self.setChannel()
-
-   # Set color from RGB color space values
-   # expects values: red, green, blue, dimmer
-   # NOTE: Performs color correction for DMX fixture by adjusting
-   #       values by percentages to achieve 'white' output
-   def setRGB(self, r, g, b, d=255):
-      # reset fixture values to all off
-      self.reset()
-
-      # color correction for the fixtures
-      # color correct blue only if some green is specified
-      gamma = 0.33
-      if r or g:
-         b = b * gamma
-      b = int(clamp(b))
-
-      # color correct green only if some blue is specified
-      alpha = 0.55
-      if r or b:
-         g = g * alpha
-      g = int(clamp(g))
-
-      beta = 1
-      if b or g:
-         r = r * beta
-      r = int(clamp(r))
-
-      self.setParams(**{'dimmer': d, 'red': r, 'green': g, 'blue': b})
-      # set the channel params, but not rendered
-      self.setChannel()
-
-   # Set color from HSV color space values
-   # need to consider brightness of dimmer setting?
-   def setHSV(self, h, s, v, d=255):
-      r, g, b = hsv_to_rgb(h, s, v)
-      self.setRGB(r, g, b, d)
-   
-   # Set DMX Channel values based on object attribute values
-   # NOTE: Does not take affect until rendered by DMX controller
-   def setChannel(self):
-      self.mydmx.setChannel(self.channel+1, self.dimmer)
-      self.mydmx.setChannel(self.channel+2, self.strobe)
-      self.mydmx.setChannel(self.channel+3, self.fixtureFunction[self.function])
-      self.mydmx.setChannel(self.channel+4, self.speed)
-      self.mydmx.setChannel(self.channel+5, self.red)
-      self.mydmx.setChannel(self.channel+6, self.green)
-      self.mydmx.setChannel(self.channel+7, self.blue)
-
-   # Init for Fixture - Everything Off
-   # Accepts starting channel for DMX addressing
-   def __init__(self, dmxController, channel, **kwargs):
-      self.mydmx = dmxController
-      self.channel = channel
-      # init all params to 0 or off
-      self.off()
-
 #
 # DMXController
 #
 class DMXController:
-   fixtures = list()
    effect = ''
    state = 'OFF'
+   recorder = None
+   player = None
+   vectorized = False
+   effects = None
+   inputs = None # coalesced sACN input, once the receiver is running
+   deferred = 0 # open transactions; render() is held back until they commit
+   pending = False # a render was asked for inside a transaction
+   batchSize = 64 # most queued commands applied as one frame
 
    # all the keys will be initialized as class attributes
    allowed_keys = set(['dimmer', 'red', 'blue', 'green'])
    
-   # Add a PAR fixture to control set
-   def addPar(self, channel):
-      par = ParFixture(self, channel)
-      self.fixtures.append(par)
-      return par
+   # Add a fixture of the named profile to control set, patched at (universe, channel)
+   def addFixture(self, profile, channel, universe=1, name=None):
+      fixture = self.profiles[profile].fixtureClass(self, channel, universe, name)
+      self.fixtures.append(fixture)
+      self.recompile()
+      return fixture
+
+   # Fixtures in a named group or zone, or every fixture if no group is given
+   # Group names are not case sensitive; an unknown group is a ValueError.
+   def members(self, group=None):
+      if group is None:
+         return self.fixtures
+      try:
+         return self.groups[group.lower()]
+      except KeyError:
+         raise ValueError('Unknown group %s' % group)
+
+   # Compile named groups from the [groups] config section, once
+   # Each entry is: name = member member ... where a member is a fixture
+   # name or another group, so zones can be built from groups.
+   def compileGroups(self, config):
+      named = {fixture.name: fixture for fixture in self.fixtures if fixture.name}
+      entries = dict(config.items('groups')) if config.has_section('groups') else {}
+      groups = {}
+      def resolve(name, seen):
+         if name in groups:
+            return groups[name]
+         if name in seen:
+            raise ValueError('Group %s contains itself' % name)
+         members = []
+         for member in entries[name].split():
+            if member in entries:
+               members.extend(resolve(member, seen + (name,)))
+            else:
+               members.append(named[member])
+         # keep patch order and drop duplicates
+         order = {id(fixture): fixture for fixture in members}
+         groups[name] = [fixture for fixture in self.fixtures if id(fixture) in order]
+         return groups[name]
+      for name in entries:
+         resolve(name, ())
+      self.groups = groups
+      self.recompile()
+
+   # Vectorized engine for whole-rig or group changes, if enabled and NumPy is present
+   def vector(self, group=None):
+      if not self.vectorized:
+         return None
+      if group not in self.engines:
+         members = self.members(group)
+         if not members:
+            return None
+         self.engines[group] = fixturearray.FixtureArray(members)
+      return self.engines[group]
+
+   def recompile(self):
+      self.engines = {}
+      self.compiledScenes = {}
+
+   # Change a fixture's colour calibration, eg. calibrate(fixture, blue={'mix': 0.3})
+   # Everything compiled from the old calibration is rebuilt: vector engines,
+   # scenes and running software effects.
+   def calibrate(self, fixture, **calibration):
+      fixture.calibrate(**calibration)
+      self.recompile()
+      self.compileScenes()
+      if self.effects:
+         self.effects.recompile()
+
+   # Compile every scene against the current patch
+   # Group activations are compiled for their members on first use.
+   def compileScenes(self):
+      self.compiledScenes = {(name, None): scene.compile(self.fixtures, self.groups)
+            for name, scene in self.scenes.items()}
+
+   # Activate a compiled scene on all fixtures (or a group) and render it
+   def activateScene(self, name, group=None):
+      key = (name, group)
+      if key not in self.compiledScenes:
+         self.compiledScenes[key] = self.scenes[name].compile(self.members(group), self.groups)
+      compiled = self.compiledScenes[key]
+      self.stopEffect(group)
+      compiled.apply()
+      if compiled.scene.saved:
+         self.__dict__.update(compiled.scene.saved)
+      self.render()
+
+   # Add a PAR fixture to control set, patched at (universe, channel)
+   def addPar(self, channel, universe=1):
+      return self.addFixture('par', channel, universe)
+
+   # Patch fixtures from the [patch] config section
+   # Each entry is: name = profile channel [universe]
+   # A [calibration] entry of the same name overrides the profile's colour calibration.
+   def patch(self, config):
+      if not config.has_section('patch'):
+         return
+      for name, entry in config.items('patch'):
+         fields = entry.split()
+         universe = int(fields[2]) if len(fields) > 2 else 1
+         fixture = self.addFixture(fields[0], int(fields[1]), universe, name)
+         if config.has_option('calibration', name):
+            # nothing is compiled yet; that happens once the patch is complete
+            fixture.calibrate(**self.calibration(config.get('calibration', name)))
+      self.compileGroups(config)
+      self.compileScenes()
+
+   # Parse a [calibration] entry: color.factor value pairs, eg. blue.mix 0.3
+   def calibration(self, entry):
+      fields = entry.split()
+      calibration = {}
+      for setting, value in zip(fields[0::2], fields[1::2]):
+         color, factor = setting.split('.')
+         calibration.setdefault(color, {})[factor] = float(value)
+      return calibration
 
    # Render all changes to DMX bus
+   # Inside a transaction the frame is only sent when the transaction commits.
    def render(self):
-      self.mydmx.render() # render all of the above changes onto the DMX network
+      self.refresh()
       if self.dimmer > 0:
          self.state = 'ON'
 
+   # Render for an effect or fade tick, leaving the on/off state alone
+   def refresh(self):
+      if self.deferred:
+         self.pending = True
+      else:
+         self.flush()
+
+   # Put the frame on the DMX bus
+   def flush(self):
+      if self.recorder:
+         self.recorder.capture(self.mydmx)
+      self.latency.rendered()
+      self.mydmx.render() # render all of the above changes onto the DMX network
+      # a frame with nothing new in it is never written; count it as done
+      if not any(output.unsent() for universe, output in self.mydmx):
+         self.latency.written()
+
+   # Batch changes so they go out as one frame, eg.
+   #    with controller.transaction():
+   #       controller.sceneRGB(...)
+   #       controller.setScene(...)
+   # Transactions nest; the outermost one renders once on exit, if anything
+   # asked for a render. Outputs only ever send rendered frames, so nothing
+   # written inside a transaction reaches the wire before it commits.
+   @contextlib.contextmanager
+   def transaction(self):
+      self.deferred += 1
+      try:
+         yield self
+      finally:
+         self.deferred -= 1
+         if not self.deferred and self.pending:
+            self.pending = False
+            self.flush()
+
+   # Queue a change to the lights for the writer thread and return at once
+   # All mutations go through here, from whichever thread: MQTT, sACN,
+   # effects, startup. One writer applies them in order, so they never
+   # interleave. Returns a Future for the command's result.
+   def post(self, command, *args, **kwargs):
+      future = Future()
+      self.commands.put((future, command, args, kwargs))
+      return future
+
+   # Run a change on the writer thread and wait for its result
+   # Run directly when already on the writer thread.
+   def call(self, command, *args, **kwargs):
+      if threading.current_thread() is self.writer:
+         return command(*args, **kwargs)
+      return self.post(command, *args, **kwargs).result()
+
+   # The writer thread: take whatever commands are queued, up to batchSize,
+   # and apply them in one transaction so the batch goes out as one frame
+   def _write(self):
+      commands = self.commands
+      while True:
+         batch = [commands.get()]
+         try:
+            while len(batch) < self.batchSize:
+               batch.append(commands.get_nowait())
+         except queue.Empty:
+            pass
+         with self.transaction():
+            for future, command, args, kwargs in batch:
+               if not future.set_running_or_notify_cancel():
+                  continue
+               try:
+                  future.set_result(command(*args, **kwargs))
+               except Exception as error:
+                  # most commands are posted and never waited on, so say so here
+                  print('Command %s failed:' % getattr(command, '__name__', command))
+                  traceback.print_exc()
+                  future.set_exception(error)
+
+   # The levels a change would leave on the fixtures, without it reaching the
+   # outputs. The change is made and undone inside one transaction; outputs
+   # only send rendered frames, so the only frame it can publish is the
+   # restored one.
+   def preview(self, members, change, *args):
+      with self.transaction():
+         start = [bytes(fixture.view) for fixture in members]
+         change(*args)
+         targets = [bytes(fixture.view) for fixture in members]
+         for fixture, levels in zip(members, start):
+            fixture.write(0, levels)
+      return targets
+
+   # Record every rendered frame to a show file
+   def record(self, path):
+      self.stopRecording()
+      self.recorder = recorder.FrameRecorder(path)
+
+   def stopRecording(self):
+      if self.recorder:
+         self.recorder.close()
+         self.recorder = None
+
+   # Play a recorded show file back onto the outputs at its original timing
+   # Frames are applied by the writer thread like any other change.
+   def replay(self, path, loop=False):
+      self.stopReplay()
+      self.player = recorder.FramePlayer(path, self, self.post)
+      self.player.play(loop)
+
+   def stopReplay(self):
+      if self.player:
+         self.player.close()
+         self.player = None
+
    # Set the DMX channel to specified value
    # NOTE: Does not affect fixture until rendered
-   def setChannel(self, channel, value):
-      self.mydmx.setChannel(channel, value)
+   def setChannel(self, channel, value, universe=1):
+      self.mydmx.setChannel(channel, value, universe)
+
+   # Set a block of DMX channels starting at the specified channel
+   # NOTE: Does not affect fixture until rendered
+   def setChannels(self, start, values, universe=1):
+      self.mydmx.setChannels(start, values, universe)
 
-   # Set all fixtures to a single color by RGB color space
-   def sceneRGB(self, r, g, b, d=255):
+   # Set all fixtures (or a group) to a single color by RGB color space
+   def sceneRGB(self, r, g, b, d=255, group=None):
       saveParams = {'dimmer': d, 'red': r, 'green': g, 'blue': b}
       self.__dict__.update((key, value) for key, value in iter(saveParams.items()))
-      for par in self.fixtures:
-         par.setRGB(r, g, b, d)
-      self.render()
-      self.effect = ''
-
-   # Set all fixtures to a single color by RGB color space, but do NOT save params
-   def renderRGB(self, r, g, b, d=255):
-      for par in self.fixtures:
-         par.setRGB(r, g, b, d)
+      self.renderRGB(r, g, b, d, group)
+
+   # Set all fixtures (or a group) to a single color by RGB color space, but do NOT save params
+   def renderRGB(self, r, g, b, d=255, group=None):
+      self.stopEffect(group)
+      engine = self.vector(group)
+      if engine:
+         engine.setRGB(r, g, b, d)
+      else:
+         for par in self.members(group):
+            par.setRGB(r, g, b, d)
       self.render()
       self.effect = ''
 
    # Set all fixtures to a single color by HSV color space percent values
-   def sceneHSV(self, h, s, v, d=255):
-      r, g, b = hsv_to_rgb(h, s, v)
-      self.sceneRGB(r, g, b, d)
+   def sceneHSV(self, h, s, v, d=255, group=None):
+      r, g, b = fixturelib.hsv_to_rgb(h, s, v)
+      self.sceneRGB(r, g, b, d, group)
    
    # Set all fixtures to a single color by a CSS3 color name string
-   def sceneColor(self, color, dimmer=255):
+   def sceneColor(self, color, dimmer=255, group=None):
       # convert color to RGB
       try:
          r, g, b = webcolors.name_to_rgb(color)
       except ValueError:
          r, g, b = webcolors.name_to_rgb('white')
-      self.sceneRGB(r, g, b, dimmer)
-
-   # Define a Police scene (red, blue, strobe)
-   def scenePolice(self):
-      for par in self.fixtures:
-         par.reset() # reset params
-         if self.fixtures.index(par) % 2:
-            par.setParams(**{'dimmer': 255, 'strobe': 20, 'red': 255})
-         else:
-            par.setParams(**{'dimmer': 255, 'strobe': 20, 'blue': 255})
-      self.render()
-
-   # Set a scene based on pre-defined labels and associated colors/functions
-   def setScene(self, name):
-      if name == 'police':
-         self.scenePolice()
-      elif name == 'movie':
-         self.sceneRGB(255, 144, 21, 77)
-      elif name == 'colorloop':
-         self.allFixtures(**{'dimmer': 255, 'function': 'gradual', 'speed': 125})
-      elif name == 'party':
-         self.allFixtures(**{'dimmer': 255, 'function': 'jump', 'speed': 200})
-      elif name == 'sound':
-         self.allFixtures(**{'dimmer': 255, 'function': 'sound', 'speed': 200})
-      elif name == 'night':
-         self.sceneRGB(36, 91, 255, 130)
-      elif name == 'reset':
-         self.sceneColor('white', 255)
+      self.sceneRGB(r, g, b, dimmer, group)
+
+   # Set a scene by name: a software effect if one is running under that
+   # name, otherwise one of the compiled scenes from the [scenes] config
+   def setScene(self, name, group=None):
+      if name in self.softEffects:
+         self.runEffect(name, group)
+      elif name in self.scenes:
+         self.activateScene(name, group)
       # set effect last as it is reset by methods above
       self.effect = name
 
-   # Pass a set of parameters to all fixtures and render the result
-   def allFixtures(self, **kwargs):
-      for par in self.fixtures:
-         par.reset()  # clear old params
-         par.setParams(**kwargs)
+   # Run a software effect, phase-locked across all fixtures (or a group)
+   # Its ticks only refresh(), so the rig is marked on here, as render() would.
+   def runEffect(self, name, group=None):
+      members = self.members(group)
+      if members:
+         self.effects.run(group, self.softEffects[name], members)
+         if self.dimmer > 0:
+            self.state = 'ON'
+
+   # Stop software effects touching all fixtures (or a group)
+   def stopEffect(self, group=None):
+      if self.effects and self.effects.active:
+         self.effects.stop(None if group is None else self.members(group))
+
+   # Pass a set of parameters to all fixtures (or a group) and render the result
+   def allFixtures(self, group=None, **kwargs):
+      self.stopEffect(group)
+      engine = self.vector(group)
+      if engine:
+         engine.setParams(**kwargs)
+      else:
+         for par in self.members(group):
+            par.reset()  # clear old params
+            par.setParams(**kwargs)
       self.render()
 
-   # Turn Off all Fixtures
-   def off(self):
-      for par in self.fixtures:
+   # Turn Off all Fixtures (or a group)
+   def off(self, group=None):
+      self.stopEffect(group)
+      for par in self.members(group):
          par.off()
       self.render()
       self.state = 'OFF'
@@ -235,34 +359,76 @@ class DMXController:
    # Control dimmer of all fixtures
    # NOTE: Side-Affect - sets fixtures to a single color!
    # eg. This would break scene 'police'
-   def dimOnly(self, d):
-      self.sceneRGB(self.red, self.green, self.blue, d)
+   def dimOnly(self, d, group=None):
+      self.sceneRGB(self.red, self.green, self.blue, d, group)
    
    # Set Fixtures to last known color and brightness
    # NOTE: Side-Affect - sets fixtures to a single color!
    # eg. This would break scene 'police'
-   def on(self):
-      self.sceneRGB(self.red, self.green, self.blue, self.dimmer)
+   def on(self, group=None):
+      self.sceneRGB(self.red, self.green, self.blue, self.dimmer, group)
       self.state = 'ON'
 
+   # Apply the light settings from a command: brightness, state, color, effect
+   # The settings are resolved into one target first, so the fixtures only
+   # ever see the end result and it is rendered once. Later settings win as
+   # they would applied one after another: an effect over a color, a color
+   # over the state, the state over a bare brightness.
+   def applyCommand(self, params, group=None):
+      with self.transaction():
+         if ('brightness' in params):
+            self.dimmer = int(params['brightness'])
+         if ('color' in params):
+            self.red = int(params['color']['r'])
+            self.green = int(params['color']['g'])
+            self.blue = int(params['color']['b'])
+         state = params.get('state')
+         if state is not None:
+            self.state = 'ON' if state == 'ON' else 'OFF'
+
+         if ('effect' in params):
+            self.setScene(params['effect'], group)
+         elif ('color' in params):
+            self.sceneRGB(self.red, self.green, self.blue, self.dimmer, group)
+         elif state == 'ON':
+            self.on(group)
+         elif state is not None:
+            self.off(group)
+         elif ('brightness' in params):
+            self.dimOnly(self.dimmer, group)
+
+   # MQTT commands are parsed on the MQTT thread and applied by the writer
    def on_message(self, client, message):
+      trace = self.latency.begin()
       params = json.loads(message.payload.decode('utf-8'))
-      status = {}
+      self.latency.stamp(trace)
+      self.post(self.handleCommand, client, params, trace)
+      return
 
-      if ('brightness' in params):
-         self.dimOnly(int(params['brightness']))
-      if ('state' in params):
-         if params['state'] == 'ON':
-            self.on()
-         else:
-            self.off()
-      if ('color' in params):
-         r = int(params['color']['r'])
-         g = int(params['color']['g'])
-         b = int(params['color']['b'])
-         self.sceneRGB(r, g, b, self.dimmer)
-      if ('effect' in params):
-         self.setScene(params['effect'])
+   def handleCommand(self, client, params, trace=None):
+      status = {}
+      # optional: only apply the command to a named group or zone
+      group = params.get('group')
+      if group is not None:
+         group = str(group).lower()
+         if group not in self.groups:
+            print('Ignoring command for unknown group %s' % group)
+            return
+      # optional: fade to the new state over this many seconds
+      transition = float(params.get('transition', 0))
+      members = list(self.members(group))
+      # a new command takes over from any fade on the same fixtures
+      self.fades.cancel(members)
+
+      # a software effect has no fixed target to fade to; it just starts
+      if transition > 0 and params.get('effect') not in self.softEffects:
+         # work out the target without sending it, then fade there
+         targets = self.preview(members, self.applyCommand, params, group)
+         self.fades.fade(members, targets, transition)
+      else:
+         self.applyCommand(params, group)
+      if trace:
+         self.latency.applied(trace)
       
       status['state'] = self.state
       status['brightness'] = self.dimmer
@@ -272,16 +438,133 @@ class DMXController:
       status['color']['b'] = self.blue
       status['effect'] = self.effect
 
-      # Send the message back
-      client.update(status, fmt='json', retain=True)
+      # Send the message back, if anything changed
+      client.update_state(status)
       return
 
+   # Open the output for one universe from its config section
+   # Enttec widgets get their timing negotiated from the same section.
+   def openUniverse(self, config, section):
+      output = backends.openOutput(config[section] if config.has_section(section) else {})
+      if isinstance(output, pysimpledmx.DMXConnection):
+         # negotiate widget timing; anything not configured is left as the widget has it
+         timing = {key: config.getfloat(section, option) for key, option in
+               (('break_time', 'breakTime'), ('mab_time', 'mabTime'), ('rate', 'widgetRate'))
+               if config.has_option(section, option)}
+         if timing:
+            output.setParameters(**timing)
+         else:
+            output.getParameters()
+      return output
+
    # Init controller
    # Starting values for fixture attributes set to 255 (r,g,b,d)
    # Those starting values enable self.on to light up all fixtures.
-   def __init__(self):
+   # [dmx] configures universe 1 (Enttec by default); [dmx.N] adds universe N.
+   # A non-zero output rate gives every universe a fixed-rate output thread.
+   # Fixture profiles are loaded from the directory named by [fixtures] profiles.
+   # Changes to the lights are applied by a single writer thread; see post().
+   def __init__(self, config):
       self.__dict__.update((key, 0) for key in self.allowed_keys)
-      self.mydmx = pysimpledmx.DMXConnection('/dev/ttyUSB0')
+      self.fixtures = list()
+      self.groups = {}
+      self.engines = {}
+      self.compiledScenes = {}
+      definitions = dict(scenes.DEFAULT_SCENES)
+      if config.has_section('scenes'):
+         definitions.update(config.items('scenes'))
+      self.scenes = {name: scenes.Scene(name, definition)
+            for name, definition in definitions.items()}
+      self.vectorized = (config.getboolean('dmx', 'vectorized', fallback=False)
+            and fixturearray.FixtureArray.available())
+      self.profiles = fixturelib.loadProfiles(config.get('fixtures', 'profiles',
+            fallback='../config/fixtures'))
+      self.commands = queue.SimpleQueue()
+      self.writer = threading.Thread(target=self._write, daemon=True)
+      self.writer.start()
+      self.mydmx = universes.DMXUniverses()
+      self.mydmx.add(1, self.openUniverse(config, 'dmx'))
+      for section in config.sections():
+         if section.startswith('dmx.'):
+            self.mydmx.add(int(section[4:]), self.openUniverse(config, section))
+      # time from a command arriving to its frame being written
+      self.latency = latency.LatencyTracker()
+      for universe, output in self.mydmx:
+         output.written = self.latency.written
+      rate = config.getfloat('dmx', 'rate', fallback=0)
+      if rate > 0:
+         self.mydmx.start(rate)
+      # software effects replace the fixtures' built-in programs when enabled
+      self.softEffects = {}
+      if config.getboolean('effects', 'software', fallback=False):
+         spread = config.getfloat('effects', 'spread', fallback=0.0)
+         self.softEffects = {
+            'colorloop': effects.colorLoop(config.getfloat('effects', 'colorloop', fallback=10.0), spread),
+            'party': effects.jump(config.getfloat('effects', 'party', fallback=0.5), spread),
+            'pulse': effects.pulse(period=config.getfloat('effects', 'pulse', fallback=2.0), spread=spread),
+         }
+         self.effects = effects.EffectEngine(self.refresh,
+               config.getfloat('effects', 'rate', fallback=40), self.call)
+      # fades step at the output refresh rate
+      self.fades = fades.FadeEngine(self.refresh, rate if rate > 0 else 40, self.call)
+      if config.has_option('dmx', 'record'):
+         self.record(config.get('dmx', 'record'))
+
+
+#
+# SACNInput
+#
+# The receive side of sACN: packets from every source are merged, then
+# coalesced to at most one apply per output tick. main() hands it the
+# receiver's packets; the benchmark drives it the same way.
+#
+class SACNInput:
+
+   # Apply merged levels through the input patch, or, without one, the
+   # first three slots set every fixture's colour
+   def apply(self, levels, trace):
+      if self.patch:
+         self.patch.apply(levels)
+      else:
+         r,g,b = levels[0:3]
+         self.controller.renderRGB(r,g,b)
+      if trace:
+         self.controller.latency.applied(trace)
+      return
+
+   # Merge one packet (shaped like sacn.DataPacket); called on the receiver thread
+   def receive(self, packet):
+      latency = self.controller.latency
+      trace = latency.begin()
+      if self.merge.update(packet.cid, packet.dmxData, packet.priority, packet.sourceName,
+                           getattr(packet, 'option_StreamTerminated', False)):
+         latency.stamp(trace)
+         self.inputs.submit(packet.universe, self.merge.levels, trace)
+      else:
+         self.inputs.drop()
+      return
+
+   # Every source has gone quiet: forget them and put the lights back on
+   def timeout(self):
+      self.merge.expire()
+      self.controller.post(self.controller.on)
+      return
+
+   def __init__(self, controller, config):
+      self.controller = controller
+      self.universe = config.getint('sacn', 'universe', fallback=1)
+      # with an input patch, the desk drives fixtures and channels directly
+      self.patch = inputpatch.InputPatch(controller, config)
+      # several desks or automation sources may send the same universe
+      self.merge = sacnmerge.MergeEngine(config.get('sacn', 'mode', fallback='htp'),
+                                         config.getfloat('sacn', 'timeout', fallback=2.5))
+      # the receiver only keeps the newest merged levels; they are applied
+      # at most once per output tick
+      self.inputs = coalesce.InputCoalescer({self.universe: self.apply},
+                                            config.getfloat('dmx', 'rate', fallback=0) or 40,
+                                            controller.call)
+      controller.inputs = self.inputs
+      return
 
 
 def main():
@@ -292,76 +575,58 @@ def main():
    status = {}
    if len(sys.argv) > 1:
       cmd = sys.argv[1]
-      mydmx = pysimpledmx.DMXConnection('/dev/ttyUSB0')
+      mydmx = backends.openOutput(config['dmx'] if config.has_section('dmx') else {})
 
       if cmd == 'off':
-         mydmx.setChannel(11, 0)
-         mydmx.setChannel(12, 0)
-         mydmx.setChannel(13, 0)
-         mydmx.setChannel(14, 0)
-         mydmx.setChannel(15, 0)
-         mydmx.setChannel(16, 0)
-         mydmx.setChannel(17, 0)
-
-         mydmx.setChannel(21, 0)
-         mydmx.setChannel(22, 0)
-         mydmx.setChannel(23, 0)
-         mydmx.setChannel(24, 0)
-         mydmx.setChannel(25, 0)
-         mydmx.setChannel(26, 0)
-         mydmx.setChannel(27, 0)
+         mydmx.setChannels(11, (0, 0, 0, 0, 0, 0, 0))
+         mydmx.setChannels(21, (0, 0, 0, 0, 0, 0, 0))
 
       elif cmd == 'test':
-         mydmx.setChannel(11, 255)
-         mydmx.setChannel(12, 0)
-         mydmx.setChannel(13, 0)
-         mydmx.setChannel(14, 0)
-         mydmx.setChannel(15, 255)
-         mydmx.setChannel(16, 180)
-         mydmx.setChannel(17, 90)
-
-         mydmx.setChannel(21, 255)
-         mydmx.setChannel(22, 0)
-         mydmx.setChannel(23, 0)
-         mydmx.setChannel(24, 0)
-         mydmx.setChannel(25, 255)
-         mydmx.setChannel(26, 180)
-         mydmx.setChannel(27, 90)
+         mydmx.setChannels(11, (255, 0, 0, 0, 255, 180, 90))
+         mydmx.setChannels(21, (255, 0, 0, 0, 255, 180, 90))
 
       mydmx.render() # render all of the above changes onto the DMX network
 
    else:
       try:
          # initialization
-         mydmx = DMXController()
-         par1 = mydmx.addPar(10)
-         par2 = mydmx.addPar(20)
-         mydmx.render()
-         # set white as preset to turn 'ON' works as expected
-         mydmx.sceneColor('white')
-         mydmx.off()
+         mydmx = DMXController(config)
+         def startup():
+            mydmx.patch(config)
+            mydmx.render()
+            # set white as preset to turn 'ON' works as expected
+            mydmx.sceneColor('white')
+            mydmx.off()
+         mydmx.call(startup)
 
          client = mymqtt.mymqtt(config, mydmx)
          client.loop_start()
+         # latency percentiles go out with the system stats
+         stats = getattr(client, 'stats', None)
+         if stats:
+            stats.addSensors(mydmx.latency.sensors(), mydmx.latency.report)
 
          receiver = sacn.sACNreceiver()
          receiver.start()  # start the receiving thread
 
-         # define a callback function
-         @receiver.listen_on('universe', universe=1)  # listens on universe 1
+         sacninput = SACNInput(mydmx, config)
+         # the sACN packet counters go out with the system stats too
+         if stats:
+            stats.addSensors(sacninput.inputs.sensors(), sacninput.inputs.report)
+
+         @receiver.listen_on('universe', universe=sacninput.universe)
          def callback(packet):  # packet type: sacn.DataPacket
-            r,g,b = packet.dmxData[0:3]
-            mydmx.renderRGB(r,g,b)
+            sacninput.receive(packet)
 
          @receiver.listen_on('availability') # what is the status?
          def e131_avail(universe, changed): # universe number and changed state
             if (changed == 'timeout'):
-               mydmx.on()
+               sacninput.timeout()
 
          # Wait forever for msgs
 
       except:
-         mydmx.off()
+         mydmx.call(mydmx.off)
 
    return
 
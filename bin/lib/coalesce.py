@@ -0,0 +1,83 @@
+"""
+  Coalesces incoming universe data ahead of the renderer.
+
+  Receiver threads submit the latest levels for a universe and return
+  straight away. Only the newest data for each universe is kept, and it is
+  handed on at most once per output tick, so a busy desk (or several)
+  costs one render per tick rather than one per packet.
+"""
+
+from lib.ticker import Ticker
+
+COUNTERS = ('received', 'coalesced', 'dropped', 'delivered')
+
+class InputCoalescer(Ticker):
+   """
+   Latest-wins hand-off from receivers to a per-universe handler.
+
+   received counts every packet seen, coalesced those replaced by newer
+   data before they were handed on, and dropped those that needed no work
+   at all (nothing changed, or no handler for the universe).
+   """
+
+   def submit(self, universe, data, trace=None):
+      """ Keep data as the newest for universe; hand on at the next tick.
+      trace, if given, is handed on with it.
+      """
+      data = bytes(data)
+      with self.lock:
+         self.received += 1
+         if universe not in self.handlers:
+            self.dropped += 1
+            return
+         if universe in self.pending:
+            self.coalesced += 1
+         self.pending[universe] = (data, trace)
+      self.wake()
+      return
+
+   def drop(self):
+      """ Count a packet that was received but needs nothing done. """
+      with self.lock:
+         self.received += 1
+         self.dropped += 1
+      return
+
+   def counters(self):
+      """ The packet counters, as a dict. """
+      return {name: getattr(self, name) for name in COUNTERS}
+
+   def sensors(self):
+      """ Sensor key -> (name, unit) for every packet counter. """
+      return {'sacn_%s' % name: ('sACN %s' % name.capitalize(), 'packets') for name in COUNTERS}
+
+   def report(self):
+      """ Sensor key -> packets counted since the coalescer started. """
+      return {'sacn_%s' % name: count for name, count in self.counters().items()}
+
+   def step(self, elapsed):
+      # swap the batch out here, under the lock; it is delivered afterwards
+      # so receivers never wait on a render
+      self.batch, self.pending = self.pending, {}
+      return bool(self.batch)
+
+   def _deliver(self):
+      batch, self.batch = self.batch, {}
+      for universe, (data, trace) in batch.items():
+         self.handlers[universe](data, trace)
+      self.delivered += len(batch)
+      return
+
+   def __init__(self, handlers, rate=40, call=None):
+      """ handlers maps a universe number to a callable taking its levels
+      and the latency trace of the packet they came from (or None).
+      """
+      Ticker.__init__(self, self._deliver, rate, call)
+      self.handlers = handlers
+      self.pending = {}
+      self.batch = {}
+      self.received = 0
+      self.coalesced = 0
+      self.dropped = 0
+      self.delivered = 0
+      return
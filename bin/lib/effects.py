@@ -0,0 +1,107 @@
+"""
+  Software lighting effects on a fixed-rate tick.
+
+  Each effect is a function of time sampled into a table once: stepping an
+  effect is a table lookup per fixture plus a slice write into the universe
+  buffer. Every fixture reads the same clock, so they stay phase-locked; a
+  spread offsets fixtures along the table to make the effect travel.
+"""
+
+from lib.fixtures import hsv_to_rgb
+from lib.ticker import Ticker
+
+class Effect:
+   """
+   A looping sequence of colours. steps holds (r, g, b, dimmer) entries and
+   period is the time one pass through them takes.
+   """
+
+   def __init__(self, steps, period, spread=0.0):
+      self.steps = steps
+      self.period = float(period)
+      self.spread = spread
+      self.count = len(steps)
+      self.tables = {}
+      return
+
+   def table(self, fixture):
+      """
+      The effect as fixture levels, one bytes per step, built the first
+      time a fixture type and calibration is seen and shared after that.
+      """
+      key = (fixture.profile, fixture.correction)
+      if key not in self.tables:
+         self.tables[key] = [bytes(fixture.levelsRGB(r, g, b, d))
+               for r, g, b, d in self.steps]
+      return self.tables[key]
+
+   def compile(self, fixtures):
+      """ Per fixture (fixture, levels table, step offset) for apply(). """
+      return [(fixture, self.table(fixture), int(index * self.spread * self.count)
+            // max(len(fixtures), 1)) for index, fixture in enumerate(fixtures)]
+
+   def apply(self, elapsed, compiled):
+      """ Write the step for the elapsed time into every fixture. """
+      step = int(elapsed * self.count / self.period)
+      count = self.count
+      for fixture, levels, offset in compiled:
+         fixture.write(0, levels[(step + offset) % count])
+
+def colorLoop(period=10.0, spread=0.0, steps=360):
+   """ A smooth trip around the hue wheel. """
+   return Effect([hsv_to_rgb(100.0 * i / steps, 100, 100) + (255,)
+         for i in range(steps)], period, spread)
+
+def jump(hold=0.5, spread=0.0, colors=((255, 0, 0), (0, 255, 0), (0, 0, 255),
+      (255, 255, 0), (0, 255, 255), (255, 0, 255), (255, 255, 255))):
+   """ Hard cuts between colours, each held for hold seconds. """
+   return Effect([color + (255,) for color in colors], hold * len(colors), spread)
+
+def pulse(color=(255, 255, 255), period=2.0, spread=0.0, steps=64):
+   """ Breathing dimmer on a single colour. """
+   half = steps // 2
+   return Effect([tuple(color) + (255 * min(i, steps - i) // half,)
+         for i in range(steps)], period, spread)
+
+class EffectEngine(Ticker):
+   """
+   Runs the active effects on one fixed-rate tick and renders one frame per
+   tick. The tick only runs while an effect is active.
+   """
+
+   def run(self, name, effect, fixtures):
+      """ Start an effect on a set of fixtures, replacing any effect on them. """
+      with self.lock:
+         self._release(fixtures)
+         self.active[name] = (effect, effect.compile(fixtures), set(map(id, fixtures)))
+      self.wake()
+
+   def stop(self, fixtures=None):
+      """ Stop effects on any of the fixtures given, or every effect. """
+      with self.lock:
+         if fixtures is None:
+            self.active.clear()
+         else:
+            self._release(fixtures)
+
+   def recompile(self):
+      """ Rebuild the running effects' levels, eg. after a calibration change. """
+      with self.lock:
+         for name, (effect, compiled, members) in list(self.active.items()):
+            fixtures = [entry[0] for entry in compiled]
+            self.active[name] = (effect, effect.compile(fixtures), members)
+
+   def _release(self, fixtures):
+      ids = set(map(id, fixtures))
+      for name in [name for name, entry in self.active.items() if entry[2] & ids]:
+         del self.active[name]
+
+   def step(self, elapsed):
+      for effect, compiled, members in self.active.values():
+         effect.apply(elapsed, compiled)
+      return bool(self.active)
+
+   def __init__(self, render, rate=40, call=None):
+      Ticker.__init__(self, render, rate, call)
+      self.active = {}
+      return
@@ -0,0 +1,63 @@
+"""
+  Crossfades from the current fixture levels to a target over time.
+
+  Fades are integer and incremental: every channel carries a 16.16 fixed
+  point level and a per-tick step worked out once when the fade starts, so
+  a tick is one add and shift per channel. Starting a new fade on a fixture
+  mid-fade simply begins from wherever it has got to.
+"""
+
+from lib.ticker import Ticker
+
+SHIFT = 16
+
+class FadeEngine(Ticker):
+   """
+   Per-fixture fades advanced on a fixed-rate tick, one frame per tick.
+   """
+
+   def fade(self, fixtures, targets, seconds):
+      """
+      Fade each fixture from its current levels to the matching target
+      levels over seconds. Replaces any fade already running on them.
+      """
+      ticks = max(1, int(round(seconds * self.rate)))
+      with self.lock:
+         for fixture, target in zip(fixtures, targets):
+            target = bytes(target)
+            levels = [level << SHIFT for level in fixture.view]
+            # round towards zero so a fade never overshoots its target
+            steps = [int(((end << SHIFT) - level) / ticks) for level, end in zip(levels, target)]
+            self.fades[id(fixture)] = [fixture, levels, steps, target, ticks]
+      self.wake()
+
+   def cancel(self, fixtures=None):
+      """ Stop fading the fixtures given, or everything, where they are. """
+      with self.lock:
+         if fixtures is None:
+            self.fades.clear()
+         else:
+            for fixture in fixtures:
+               self.fades.pop(id(fixture), None)
+
+   def step(self, elapsed):
+      done = []
+      for key, fade in self.fades.items():
+         fixture, levels, steps, target, remaining = fade
+         remaining -= 1
+         if remaining <= 0:
+            # land exactly on the target, whatever the rounding
+            fixture.write(0, target)
+            done.append(key)
+            continue
+         fade[4] = remaining
+         levels[:] = [level + step for level, step in zip(levels, steps)]
+         fixture.write(0, [level >> SHIFT for level in levels])
+      for key in done:
+         del self.fades[key]
+      return bool(self.fades)
+
+   def __init__(self, render, rate=40, call=None):
+      Ticker.__init__(self, render, rate, call)
+      self.fades = {}
+      return
@@ -0,0 +1,149 @@
+"""
+  Vectorized rendering for large fixture counts.
+
+  Optional: needs NumPy. FixtureArray compiles the patched fixtures into
+  index arrays over the universe buffers once, then applies whole-rig
+  colour, dimming and parameter changes as array operations with a single
+  fancy-index assignment per universe.
+"""
+
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
+COLORS = ('red', 'green', 'blue')
+ROLES = ('dimmer',) + COLORS
+
+class FixtureArray:
+   """
+   The patched fixtures of a controller as arrays. Build it again after the
+   patch or any fixture calibration changes.
+   """
+
+   @staticmethod
+   def available():
+      """ True if NumPy can be imported. """
+      return np is not None
+
+   def __init__(self, fixtures):
+      """
+      Compile the fixtures: the slots of every fixture in one index array
+      per universe, where each role sits in that array, per fixture clamp
+      ranges and the stacked colour correction tables.
+      """
+      fixtures = sorted(fixtures, key=lambda fixture: fixture.universe)
+      self.fixtures = fixtures
+      self.count = len(fixtures)
+      # a structured array of the per-fixture colour parameters
+      self.params = np.zeros(self.count, dtype=[(role, 'u1') for role in ROLES])
+
+      slots = []
+      self.universes = []
+      self.positions = {}
+      self.members = {}
+      self.low = {}
+      self.high = {}
+      members = {role: [] for role in ROLES}
+      positions = {role: [] for role in ROLES}
+      lows = {role: [] for role in ROLES}
+      highs = {role: [] for role in ROLES}
+      start = 0
+      for index, fixture in enumerate(fixtures):
+         profile = fixture.profile
+         if not self.universes or self.universes[-1][0] is not fixture.output:
+            self.universes.append([fixture.output, start, start])
+         for role, offset in profile.roles.items():
+            if role in members:
+               members[role].append(index)
+               positions[role].append(start + offset)
+               lows[role].append(profile.low[offset])
+               highs[role].append(profile.high[offset])
+         slots.extend(range(fixture.channel, fixture.channel + profile.size))
+         start += profile.size
+         self.universes[-1][2] = start
+      self.values = np.zeros(start, dtype=np.uint8)
+      self.slots = np.array(slots, dtype=np.intp)
+      for role in ROLES:
+         self.members[role] = np.array(members[role], dtype=np.intp)
+         self.positions[role] = np.array(positions[role], dtype=np.intp)
+         self.low[role] = np.array(lows[role], dtype=np.int32)
+         self.high[role] = np.array(highs[role], dtype=np.int32)
+      # numpy views onto each output's channel data, written in place
+      self.frames = [(output, np.frombuffer(output.dmx_frame, dtype=np.uint8), first, last)
+            for output, first, last in self.universes]
+
+      self.tables = {}
+      for color in COLORS:
+         self.tables[color] = np.array([np.frombuffer(getattr(fixture.correction, color),
+               dtype=np.uint8) for fixture in fixtures]).reshape(self.count, 256)
+         self.tables[color + 'Mixed'] = np.array([np.frombuffer(getattr(fixture.correction,
+               color + 'Mixed'), dtype=np.uint8) for fixture in fixtures]).reshape(self.count, 256)
+      self.index = np.arange(self.count)
+      return
+
+   def correct(self, r, g, b):
+      """
+      Colour correct per fixture through the calibration tables, with the
+      same cross-channel rules as Fixture.setRGB. r, g, b may be scalars
+      or arrays with one value per fixture.
+      """
+      index = self.index
+      r = np.clip(np.broadcast_to(r, self.count), 0, 255)
+      g = np.clip(np.broadcast_to(g, self.count), 0, 255)
+      b = np.clip(np.broadcast_to(b, self.count), 0, 255)
+      t = self.tables
+      b = np.where((r > 0) | (g > 0), t['blueMixed'][index, b], t['blue'][index, b])
+      g = np.where((r > 0) | (b > 0), t['greenMixed'][index, g], t['green'][index, g])
+      r = np.where((b > 0) | (g > 0), t['redMixed'][index, r], t['red'][index, r])
+      return r, g, b
+
+   def setRGB(self, r, g, b, d=255):
+      """
+      Vectorized Fixture.setRGB across every fixture; r, g, b and d may be
+      scalars or per-fixture arrays. Not rendered.
+      """
+      r, g, b = self.correct(r, g, b)
+      params = self.params
+      params['dimmer'] = np.clip(np.broadcast_to(d, self.count), 0, 255)
+      params['red'] = r
+      params['green'] = g
+      params['blue'] = b
+      self.values[:] = 0
+      for role in ROLES:
+         self.place(role, params[role])
+      self.scatter()
+      for fixture in self.fixtures:
+         fixture.effect = ''
+
+   def setParams(self, **kwargs):
+      """
+      Vectorized reset plus Fixture.setParams across every fixture. Levels
+      are resolved once per profile. Not rendered.
+      """
+      levels = {}
+      for fixture in self.fixtures:
+         profile = fixture.profile
+         if profile.name not in levels:
+            levels[profile.name] = bytes(profile.levels(**kwargs))
+      self.values[:] = np.frombuffer(b''.join(levels[fixture.profile.name]
+            for fixture in self.fixtures), dtype=np.uint8)
+      self.scatter()
+      for fixture in self.fixtures:
+         fixture.effect = ''
+
+   def place(self, role, values):
+      """ Put one role's per-fixture values, clamped to range, into place. """
+      members = self.members[role]
+      if len(members):
+         self.values[self.positions[role]] = np.clip(values[members],
+               self.low[role], self.high[role])
+
+   def scatter(self):
+      """ Write the compiled values into each universe in one assignment. """
+      for output, frame, first, last in self.frames:
+         slots = self.slots[first:last]
+         values = self.values[first:last]
+         if not np.array_equal(frame[slots], values):
+            frame[slots] = values
+            output.dirty = True
@@ -0,0 +1,250 @@
+"""
+  Fixture profiles and patched fixtures.
+
+  A profile is a JSON data file listing a fixture's DMX channels in order:
+
+  {
+     "name": "par",
+     "channels": [
+        {"role": "dimmer"},
+        {"role": "function", "values": {"dmx": 0, "jump": 55}},
+        {"role": "red", "range": [0, 255]}
+     ]
+  }
+
+  Each channel has a role, an optional [low, high] range its values are
+  clamped to and optional named values. Loading compiles a profile into
+  flat per-offset tables and a fixture class whose attributes are the
+  roles, so mixed fixture types need no subclassing.
+
+  A profile may also carry a colour "calibration" for setRGB, for example
+  {"blue": {"trim": 0.9, "mix": 0.33}}. trim always scales the channel
+  (white balance); mix scales it only while another colour is lit.
+"""
+
+import colorsys, os
+import simplejson as json
+
+def clamp(n, smallest=0, largest=255):
+   """ Clamp values between a range - inclusive. """
+   return max(smallest, min(n, largest))
+
+def hsv_to_rgb(h, s, v):
+   """ Convert HSV in PERCENT (not DEGREES) to RGB (0..255). """
+   # colorsys only does floats from 0 to 1 for all inputs and outputs
+   # smartthings only reports h,s,v as a percent 0 to 100
+   # convert smartthings percent to float
+   h = float(h)/100.0
+   s = float(s)/100.0
+   v = float(v)/100.0
+   r, g, b = colorsys.hsv_to_rgb(h, s, v)
+   # convert to r,g,b web space (0-255)
+   r = int(r*255.0)
+   g = int(g*255.0)
+   b = int(b*255.0)
+   return (r, g, b)
+
+# color correction to achieve 'white' output from the PARs:
+# blue only if some red or green is specified, green only if some red or
+# blue is specified, red only if some green or blue is specified
+DEFAULT_CALIBRATION = {
+   'red':   {'trim': 1.0, 'mix': 1.0},
+   'green': {'trim': 1.0, 'mix': 0.55},
+   'blue':  {'trim': 1.0, 'mix': 0.33},
+}
+
+class ColorCorrection:
+   """
+   256 entry lookup tables for one calibration, so correcting a colour is
+   table indexing. Each colour has a table for when it is lit alone and one
+   for when it is mixed with another colour. Built once per calibration and
+   shared by every fixture using it.
+   """
+   cache = {}
+
+   @classmethod
+   def get(cls, calibration):
+      """ Tables for a calibration dict, built only the first time it is seen. """
+      merged = {color: dict(DEFAULT_CALIBRATION[color], **calibration.get(color, {}))
+            for color in DEFAULT_CALIBRATION}
+      key = tuple((color, merged[color]['trim'], merged[color]['mix'])
+            for color in sorted(merged))
+      if key not in cls.cache:
+         cls.cache[key] = cls(merged)
+      return cls.cache[key]
+
+   @staticmethod
+   def table(scale):
+      return bytes(clamp(int(level * scale)) for level in range(256))
+
+   def __init__(self, calibration):
+      self.calibration = calibration
+      for color, factors in calibration.items():
+         setattr(self, color, self.table(factors['trim']))
+         setattr(self, color + 'Mixed', self.table(factors['trim'] * factors['mix']))
+      return
+
+def channelRole(offset, labels=None):
+   """
+   Attribute for one fixture channel. It reads and writes the DMX value in
+   the universe buffer directly; channels with named values read back as
+   their label.
+   """
+   def get(self):
+      value = self.view[offset]
+      if labels:
+         return labels.get(value, value)
+      return value
+   def set(self, value):
+      self.write(offset, (self.profile.level(offset, value),))
+   return property(get, set)
+
+class Fixture:
+   """
+   A patched fixture. The attributes are views onto the fixture's slots in
+   the universe buffer, so setting one writes the DMX value directly and
+   there is nothing to copy at render time. Use a profile's fixtureClass
+   rather than this class.
+   """
+   __slots__ = ('output', 'view', 'channel', 'universe', 'effect', 'name',
+         'correction')
+
+   profile = None
+
+   def write(self, offset, values):
+      """ Write a run of fixture channels in one go, starting at offset. """
+      values = bytes(values)
+      if self.view[offset:offset+len(values)] != values:
+         self.view[offset:offset+len(values)] = values
+         self.output.dirty = True
+
+   def reset(self):
+      """ Set all channels to 0. """
+      self.write(0, self.profile.blank)
+      self.effect = ''
+
+   def off(self):
+      """ Fixture Off. """
+      self.reset()
+
+   def setParams(self, **kwargs):
+      """ Shortcut to set the given roles; unknown roles are ignored. """
+      for key, value in kwargs.items():
+         if key in self.profile.roles:
+            setattr(self, key, value)
+
+   def setRGB(self, r, g, b, d=255):
+      """
+      Set color from RGB color space values, every other channel off.
+      NOTE: Performs color correction for DMX fixture through the
+            fixture's calibration tables to achieve 'white' output
+      """
+      # set, but not rendered
+      self.write(0, self.levelsRGB(r, g, b, d))
+      self.effect = ''
+
+   def levelsRGB(self, r, g, b, d=255):
+      """ The fixture's channel values for a colour, without setting them. """
+      cc = self.correction
+      r = clamp(r)
+      g = clamp(g)
+      b = clamp(b)
+      # each rule looks at the already corrected colours before it
+      b = cc.blueMixed[b] if r or g else cc.blue[b]
+      g = cc.greenMixed[g] if r or b else cc.green[g]
+      r = cc.redMixed[r] if b or g else cc.red[r]
+      return self.profile.levels(dimmer=d, red=r, green=g, blue=b)
+
+   def calibrate(self, **calibration):
+      """
+      Change the fixture's colour calibration, eg. calibrate(blue={'mix': 0.3}).
+      Colours not given keep the profile's calibration. Use the controller's
+      calibrate() on a patched fixture, so its compiled scenes follow.
+      """
+      merged = {color: dict(self.profile.calibration.get(color, {}), **factors)
+            for color, factors in calibration.items()}
+      self.correction = ColorCorrection.get(dict(self.profile.calibration, **merged))
+
+   def setHSV(self, h, s, v, d=255):
+      """ Set color from HSV color space values. """
+      r, g, b = hsv_to_rgb(h, s, v)
+      self.setRGB(r, g, b, d)
+
+   def __init__(self, dmxController, channel, universe=1, name=None):
+      """
+      Everything Off to start.
+      The fixture occupies channel+1 onwards, for profile.size channels.
+      """
+      self.output = dmxController.mydmx[universe]
+      self.view = self.output.view(channel+1, self.profile.size)
+      self.channel = channel
+      self.universe = universe
+      self.name = name
+      self.correction = self.profile.correction
+      self.off()
+
+class FixtureProfile:
+   """
+   A compiled fixture profile: role offsets, per-offset clamp ranges and
+   named values, and the fixture class built from them.
+   """
+
+   def level(self, offset, value):
+      """ DMX value for a channel, resolving names and clamping to range. """
+      names = self.values[offset]
+      if names and value in names:
+         value = names[value]
+      return clamp(int(value), self.low[offset], self.high[offset])
+
+   def levels(self, **params):
+      """
+      All of the fixture's channel values in one table-driven pass.
+      Roles not given are 0; roles the fixture does not have are ignored.
+      """
+      frame = bytearray(self.size)
+      roles = self.roles
+      for role, value in params.items():
+         offset = roles.get(role)
+         if offset is not None:
+            frame[offset] = self.level(offset, value)
+      return frame
+
+   def __init__(self, name, channels, calibration=None):
+      self.name = name
+      self.calibration = calibration or {}
+      self.correction = ColorCorrection.get(self.calibration)
+      self.size = len(channels)
+      self.blank = bytes(self.size)
+      self.roles = {}
+      self.low = []
+      self.high = []
+      self.values = []
+      attributes = {'__slots__': (), 'profile': self}
+      for offset, channel in enumerate(channels):
+         role = channel['role']
+         low, high = channel.get('range', (0, 255))
+         names = channel.get('values', {})
+         self.roles[role] = offset
+         self.low.append(low)
+         self.high.append(high)
+         self.values.append(names)
+         labels = {value: label for label, value in names.items()}
+         attributes[role] = channelRole(offset, labels)
+      self.fixtureClass = type(name, (Fixture,), attributes)
+      return
+
+   @classmethod
+   def load(cls, path):
+      """ Load and compile a profile from a JSON data file. """
+      with open(path) as f:
+         data = json.load(f)
+      return cls(data['name'], data['channels'], data.get('calibration'))
+
+def loadProfiles(directory):
+   """ Load every *.json profile in a directory, keyed by name. """
+   profiles = {}
+   for entry in sorted(os.listdir(directory)):
+      if entry.endswith('.json'):
+         profile = FixtureProfile.load(os.path.join(directory, entry))
+         profiles[profile.name] = profile
+   return profiles
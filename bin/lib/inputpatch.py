@@ -0,0 +1,62 @@
+"""
+  Patch from an incoming sACN universe straight onto the outputs.
+
+  The [sacn] config section names the universe to listen on and lists the
+  patch, one entry per line:
+
+  name = direct <first slot> <count> <output channel> [output universe]
+         copy count slots as they are onto consecutive output channels
+  name = rgb <first slot> <fixture or group>
+         one red, green, blue triple per fixture, colour corrected
+
+  Slots are numbered from 1 like DMX channels. Direct runs are one slice
+  copy each per packet.
+"""
+
+# [sacn] keys that are settings rather than patch entries
+SETTINGS = ('universe', 'mode', 'timeout')
+
+class InputPatch:
+   """
+   A compiled input patch for a DMXController.
+   """
+
+   def apply(self, data):
+      """
+      Apply one packet of slot values (any sequence of ints) and render.
+      """
+      data = memoryview(bytes(data))
+      for output, start, first, last in self.direct:
+         output.setChannels(start, data[first:last])
+      for fixture, first in self.rgb:
+         if first + 3 <= len(data):
+            fixture.setRGB(data[first], data[first+1], data[first+2])
+      self.controller.render()
+
+   def __len__(self):
+      return len(self.direct) + len(self.rgb)
+
+   def __init__(self, controller, config, section='sacn'):
+      self.controller = controller
+      self.direct = []
+      self.rgb = []
+      if not config.has_section(section):
+         return
+      named = {fixture.name: [fixture] for fixture in controller.fixtures if fixture.name}
+      for name, entry in config.items(section):
+         fields = entry.split()
+         if name in SETTINGS or not fields:
+            continue
+         kind = fields[0]
+         first = int(fields[1]) - 1
+         if kind == 'direct':
+            count = int(fields[2])
+            universe = int(fields[4]) if len(fields) > 4 else 1
+            self.direct.append((controller.mydmx[universe], int(fields[3]), first, first + count))
+         elif kind == 'rgb':
+            members = controller.groups.get(fields[2].lower()) or named[fields[2].lower()]
+            for index, fixture in enumerate(members):
+               self.rgb.append((fixture, first + 3 * index))
+         else:
+            raise ValueError('Unknown input patch type %s for %s' % (kind, name))
+      return
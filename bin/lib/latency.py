@@ -0,0 +1,141 @@
+"""
+  Latency from a command or packet arriving to its frame being written.
+
+  Each command carries a trace: a list of time.perf_counter_ns() stamps taken
+  at receive, parse, state update (the command applied to the fixtures),
+  render (the frame handed to the outputs) and write (the output done
+  sending it). Every stage, and the total, feeds its own histogram.
+
+  Histograms are log-bucketed counts, four buckets to each doubling, so
+  recording is an index calculation and one list increment with no lock.
+  A count lost to two threads racing on the same bucket does not matter to
+  the percentiles.
+"""
+
+import collections, math, time
+
+STAGES = ('parse', 'state', 'render', 'write', 'total')
+PERCENTILES = (50, 95, 99)
+SUB = 4          # buckets per doubling
+BUCKETS = 64 * SUB
+
+def bucket(ns):
+   """ Histogram bucket for a duration in nanoseconds. """
+   if ns < SUB:
+      return max(ns, 0)
+   bits = ns.bit_length()
+   index = (bits - 2) * SUB + (ns >> (bits - 3)) - SUB
+   return min(index, BUCKETS - 1)
+
+def value(index):
+   """ Middle of a bucket, in nanoseconds. """
+   if index < SUB:
+      return index
+   bits = index // SUB + 2
+   width = 1 << (bits - 3)
+   return ((index % SUB + SUB) << (bits - 3)) + width // 2
+
+class Histogram:
+   """
+   Counts of durations in log buckets.
+   """
+
+   def add(self, ns):
+      self.counts[bucket(ns)] += 1
+
+   def take(self):
+      """ Return the counts so far and start counting afresh. """
+      counts, self.counts = self.counts, [0] * BUCKETS
+      return counts
+
+   @staticmethod
+   def percentiles(counts, wanted=PERCENTILES):
+      """ Durations in nanoseconds at each wanted percentile, or None. """
+      total = sum(counts)
+      if not total:
+         return [None for p in wanted]
+      results = []
+      for p in wanted:
+         target = max(1, math.ceil(total * p / 100))
+         seen = 0
+         for index, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+               results.append(value(index))
+               break
+      return results
+
+   def __init__(self):
+      self.counts = [0] * BUCKETS
+      return
+
+class LatencyTracker:
+   """
+   Follows traces through the controller and records them once written.
+
+   Applied traces wait for the next render; rendered ones wait for the next
+   write. Both hand-offs are deques, so the writer and output threads never
+   take a lock.
+   """
+
+   @staticmethod
+   def begin():
+      """ Start a trace when a command or packet arrives. """
+      return [time.perf_counter_ns()]
+
+   @staticmethod
+   def stamp(trace):
+      """ Mark the next stage of a trace as done. """
+      trace.append(time.perf_counter_ns())
+
+   def applied(self, trace):
+      """ The trace's command has been applied; it waits for a render. """
+      trace.append(time.perf_counter_ns())
+      self.waiting.append(trace)
+
+   def rendered(self):
+      """ A frame was handed to the outputs. """
+      now = time.perf_counter_ns()
+      waiting = self.waiting
+      while waiting:
+         trace = waiting.popleft()
+         trace.append(now)
+         self.sending.append(trace)
+
+   def written(self):
+      """ An output finished writing a frame; complete the traces sent. """
+      now = time.perf_counter_ns()
+      sending = self.sending
+      histograms = self.histograms
+      while True:
+         try:
+            trace = sending.popleft()
+         except IndexError:
+            return
+         trace.append(now)
+         for stage, start, end in zip(STAGES, trace, trace[1:]):
+            histograms[stage].add(end - start)
+         histograms['total'].add(now - trace[0])
+
+   def sensors(self):
+      """ Sensor key -> (name, unit) for every stage and percentile. """
+      return {'latency_%s_p%d' % (stage, p): ('Latency %s p%d' % (stage.capitalize(), p), 'ms')
+            for stage in STAGES for p in PERCENTILES}
+
+   def report(self):
+      """
+      Sensor key -> milliseconds (None without samples) since the last
+      report, then start a new window.
+      """
+      results = {}
+      for stage in STAGES:
+         counts = self.histograms[stage].take()
+         for p, ns in zip(PERCENTILES, Histogram.percentiles(counts)):
+            results['latency_%s_p%d' % (stage, p)] = None if ns is None else round(ns / 1e6, 3)
+      return results
+
+   def __init__(self):
+      self.histograms = {stage: Histogram() for stage in STAGES}
+      self.waiting = collections.deque()
+      self.sending = collections.deque()
+      return
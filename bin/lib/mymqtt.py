@@ -11,16 +11,76 @@
   mqttSet
   mqttState
   mqttId
+
+  Optional:
+
+  stats          publish system stats sensors (default true)
+  stateInterval  minimum seconds between state publishes (default 0.25)
 """
 
 # TODO: augment LWT with interrupt handler to call specified function
 
-import socket, time
+import socket, time, threading
 import simplejson as json
 import paho.mqtt.publish as mqtt
 import paho.mqtt.client as mqttclient
 import lib.mystat as mystat
 
+class StatePublisher:
+   """
+   Publishes a device state only when it changes.
+
+   Keeps the last published state and its encoded form. An identical state
+   is dropped before any encoding. Changes that arrive within interval of
+   the last publish are held, and only the newest is sent once the interval
+   is up.
+   """
+
+   def update(self, state):
+      """ Queue a state for publishing; returns right away. """
+      with self.lock:
+         if self.timer is None and state == self.last:
+            return
+         self.pending = state
+         if self.timer is not None:
+            return
+         wait = self.sent + self.interval - time.monotonic()
+         if wait > 0:
+            self.timer = threading.Timer(wait, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+            return
+      self.flush()
+      return
+
+   def flush(self):
+      """ Publish the held state, if it still differs from the last one. """
+      with self.lock:
+         state = self.pending
+         self.pending = None
+         self.timer = None
+         if state is None or state == self.last:
+            return
+         self.last = state
+         self.encoded = json.dumps(state)
+         self.sent = time.monotonic()
+         encoded = self.encoded
+      self.client.update(encoded, fmt='plain', qos=self.qos, retain=self.retain)
+      return
+
+   def __init__(self, client, interval=0.25, qos=1, retain=True):
+      self.client = client
+      self.interval = interval
+      self.qos = qos
+      self.retain = retain
+      self.lock = threading.Lock()
+      self.last = None
+      self.encoded = None
+      self.pending = None
+      self.timer = None
+      self.sent = 0.0
+      return
+
 class mymqtt:
    """
    MyMQTT provides an MQTT object that will provide a persistent connection 
@@ -87,6 +147,13 @@ class mymqtt:
                    fmt=fmt, qos=qos, retain=retain)
       return
 
+   def update_state(self, payload):
+      """ Publish a state dict to the primary topic, retained, but only
+      when it has changed and at most once per stateInterval.
+      """
+      self.state.update(payload)
+      return
+
    def loop_forever(self):
       """ You have seen Primer(2004), correct?
       If the loop does stop, kill the stats thread.
@@ -140,6 +207,9 @@ class mymqtt:
       # set will to be executed if we disconnect prematurely
       self.mqttc.will_set(self.lwt_topic, 'Offline', retain=True)
 
+      self.state = StatePublisher(self,
+            config['main'].getfloat('stateInterval', fallback=0.25))
+
       self.mqttc.on_connect = self.on_connect
       self.mqttc.on_message = self.on_message
 
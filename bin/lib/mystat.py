@@ -85,9 +85,34 @@ class mystat:
       except:
          payload['device_type'] = -1
 
+      for read in self.extraReads:
+         try:
+            payload.update(read())
+         except:
+            pass
+
       self.client.publish(topic, payload, qos=1, fmt='json')
       return
 
+   def addSensors(self, sensors, read):
+      """ Publish discovery for extra sensors, reported with the rest.
+      sensors maps a payload key to (name, unit); read() returns a dict of
+      key: value and is called once per update.
+      """
+      topicPrefix = "homeassistant/sensor/" + self.deviceName
+      for key, (name, unit) in sensors.items():
+         config = {}
+         config['name'] = self.deviceName + " " + name
+         config['state_topic'] = topicPrefix + "/state"
+         if unit:
+            config['unit_of_measurement'] = unit
+         config['value_template'] = "{{ value_json." + key + " }}"
+
+         self.client.publish(topic=topicPrefix + "/" + self.deviceName + key + "/config",
+                             payload=config, fmt='json', qos=1, retain=True)
+      self.extraReads.append(read)
+      return
+
    def get_last_boot(self):
       """ Last Boot time. """
       tstamp = psutil.boot_time()
@@ -141,6 +166,7 @@ class mystat:
       """
       self.client = client
       self.deviceName = client.client_id
+      self.extraReads = []
       self.updateInterval = 300 # 5 mins
       self.is_rpi = pathlib.Path('/etc/rpi-issue').exists()
 
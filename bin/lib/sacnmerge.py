@@ -0,0 +1,148 @@
+"""
+  Merge several sACN sources sending the same universe.
+
+  Only sources at the highest priority heard take part, as E1.31 asks;
+  between those each slot is merged highest-takes-precedence (htp) or
+  latest-takes-precedence (ltp). A source that goes quiet for the timeout,
+  or says it is terminating, drops out. A packet only recomputes the slots
+  its source actually changed; the whole universe is merged again only
+  when the set of sources taking part changes.
+"""
+
+import time
+
+SLOTS = 512
+BLOCK = 32     # slots compared at a time when looking for changes
+
+class Source:
+   """
+   The last levels and bookkeeping for one sending source.
+   """
+
+   __slots__ = ('cid', 'name', 'priority', 'levels', 'seen')
+
+   def __init__(self, cid, name, priority, size):
+      self.cid = cid
+      self.name = name
+      self.priority = priority
+      self.levels = bytearray(size)
+      self.seen = 0
+      return
+
+class MergeEngine:
+   """
+   Incremental merge of one universe from any number of sources.
+   """
+
+   def update(self, cid, data, priority=100, name=None, terminated=False, now=None):
+      """
+      Take a packet from source cid. Returns True if the merged levels
+      changed.
+      """
+      now = time.monotonic() if now is None else now
+      changed = self.expire(now)
+      if terminated:
+         return self.remove(cid) or changed
+      data = bytes(data[:self.size])
+      source = self.sources.get(cid)
+      regroup = source is None or source.priority != priority
+      if source is None:
+         source = self.sources[cid] = Source(cid, name, priority, self.size)
+      source.priority = priority
+      source.seen = now
+      slots = self.changes(source.levels, data)
+      source.levels[:len(data)] = data
+      if regroup:
+         changed = self.remerge() or changed
+         # ltp: a source joining, or changing priority, is the latest word on
+         # every slot where it disagrees with the merge
+         if self.mode == 'ltp' and source in self.active:
+            changed = self.mergeSlots(source, self.changes(self.levels, source.levels)) or changed
+         return changed
+      if not slots or source not in self.active:
+         return changed
+      return self.mergeSlots(source, slots) or changed
+
+   def remove(self, cid):
+      """ Drop a source straight away. Returns True if the levels changed. """
+      if self.sources.pop(cid, None) is None:
+         return False
+      return self.remerge()
+
+   def expire(self, now=None):
+      """ Drop sources not heard from within the timeout. """
+      now = time.monotonic() if now is None else now
+      stale = [cid for cid, source in self.sources.items() if now - source.seen > self.timeout]
+      if not stale:
+         return False
+      for cid in stale:
+         del self.sources[cid]
+      return self.remerge()
+
+   @staticmethod
+   def changes(old, new):
+      """ Indexes of the slots that differ between old and new. """
+      count = len(new)
+      if old[:count] == new:
+         return []
+      slots = []
+      for low in range(0, count, BLOCK):
+         high = min(low + BLOCK, count)
+         if old[low:high] != new[low:high]:
+            slots.extend(i for i in range(low, high) if old[i] != new[i])
+      return slots
+
+   def mergeSlots(self, source, slots):
+      """ Recompute just the slots one source changed. """
+      levels = self.levels
+      before = bytes(levels[i] for i in slots)
+      if self.mode == 'ltp' or len(self.active) == 1:
+         owner = self.owner
+         for i in slots:
+            levels[i] = source.levels[i]
+            owner[i] = source
+      else:
+         active = [other.levels for other in self.active]
+         for i in slots:
+            levels[i] = max(other[i] for other in active)
+      return before != bytes(levels[i] for i in slots)
+
+   def remerge(self):
+      """ Work out which sources take part and merge every slot again. """
+      if not self.sources:
+         self.active = []
+         return False
+      self.priority = max(source.priority for source in self.sources.values())
+      self.active = [source for source in self.sources.values() if source.priority == self.priority]
+      before = bytes(self.levels)
+      if self.mode == 'ltp':
+         # slots keep their source if it is still taking part; anything else
+         # goes to whoever was heard from most recently
+         newest = max(self.active, key=lambda source: source.seen)
+         active = set(map(id, self.active))
+         owner = self.owner
+         for i in range(self.size):
+            if owner[i] is None or id(owner[i]) not in active:
+               owner[i] = newest
+            self.levels[i] = owner[i].levels[i]
+      elif len(self.active) == 1:
+         self.levels[:] = self.active[0].levels
+      else:
+         self.levels[:] = bytes(map(max, *(source.levels for source in self.active)))
+      return before != self.levels
+
+   def __len__(self):
+      return len(self.sources)
+
+   def __init__(self, mode='htp', timeout=2.5, size=SLOTS):
+      if mode not in ('htp', 'ltp'):
+         raise ValueError('Merge mode must be htp or ltp, not %s' % mode)
+      self.mode = mode
+      self.timeout = timeout
+      self.size = size
+      self.sources = {}
+      self.active = []
+      self.priority = None
+      self.levels = bytearray(size)
+      self.owner = [None] * size   # ltp: where each slot last came from
+      return
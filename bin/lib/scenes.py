@@ -0,0 +1,140 @@
+"""
+  Scenes compiled into ready-made fixture levels.
+
+  A scene definition is one line, as in the [scenes] config section:
+
+  rgb r g b [dimmer]                  every fixture to one colour
+  color <css3 name> [dimmer]          the same, by colour name
+  params role=value ...               set roles, everything else off
+  alternate role=value ... / ...      fixtures take turns through patterns
+
+  Any of these can be aimed at a group with @group in front, and several
+  can be combined with ';', eg. "@stage color red ; @wall color blue".
+  Later parts win where groups overlap.
+
+  Compiling a scene against the patch works out every fixture's levels once
+  (colour names, correction, named values and all), so activating it is a
+  copy of those levels into the universe buffers.
+"""
+
+import webcolors
+
+DEFAULT_SCENES = {
+   'police': 'alternate dimmer=255 strobe=20 blue=255 / dimmer=255 strobe=20 red=255',
+   'movie': 'rgb 255 144 21 77',
+   'colorloop': 'params dimmer=255 function=gradual speed=125',
+   'party': 'params dimmer=255 function=jump speed=200',
+   'sound': 'params dimmer=255 function=sound speed=200',
+   'night': 'rgb 36 91 255 130',
+   'reset': 'color white 255',
+}
+
+def parseParams(fields):
+   """ role=value fields to a dict, with numbers as ints. """
+   params = {}
+   for field in fields:
+      role, value = field.split('=', 1)
+      params[role] = int(value) if value.lstrip('-').isdigit() else value
+   return params
+
+class Scene:
+   """
+   A parsed scene definition. saved holds the colour and dimmer a colour
+   scene leaves the controller with, so on and dimOnly carry on from it.
+   """
+
+   def levels(self, fixture, index):
+      """ The fixture's channel values in this scene. """
+      if self.color:
+         return bytes(fixture.levelsRGB(*self.color))
+      pattern = self.patterns[index % len(self.patterns)]
+      return bytes(fixture.profile.levels(**pattern))
+
+   def compile(self, fixtures, groups=None):
+      """
+      Levels for every fixture, ready to activate. groups maps the group
+      names parts of the scene are aimed at to their fixtures.
+      """
+      if not self.parts:
+         return CompiledScene(self, [(fixture, self.levels(fixture, index))
+               for index, fixture in enumerate(fixtures)])
+      chosen = {}
+      for group, part in self.parts:
+         targets = fixtures
+         if group is not None:
+            if groups is None or group not in groups:
+               raise ValueError('Scene %s names unknown group %s' % (self.name, group))
+            included = set(map(id, fixtures))
+            targets = [fixture for fixture in groups[group] if id(fixture) in included]
+         for index, fixture in enumerate(targets):
+            chosen[id(fixture)] = (fixture, part.levels(fixture, index))
+      return CompiledScene(self, list(chosen.values()))
+
+   def __init__(self, name, definition):
+      self.name = name
+      self.parts = None
+      parts = [part.strip() for part in definition.split(';') if part.strip()]
+      if len(parts) > 1 or parts[0].startswith('@'):
+         self.parts = []
+         for part in parts:
+            group = None
+            if part.startswith('@'):
+               group, part = part[1:].split(None, 1)
+               group = group.lower()
+            self.parts.append((group, Scene(name, part)))
+         # a single part keeps its colour for on and dimOnly to carry on from
+         self.saved = self.parts[0][1].saved if len(parts) == 1 else None
+         return
+      fields = definition.split()
+      kind = fields[0]
+      self.color = None
+      self.patterns = None
+      self.saved = None
+      if kind in ('rgb', 'color'):
+         if kind == 'rgb':
+            r, g, b = (int(value) for value in fields[1:4])
+            rest = fields[4:]
+         else:
+            try:
+               r, g, b = webcolors.name_to_rgb(fields[1])
+            except ValueError:
+               r, g, b = webcolors.name_to_rgb('white')
+            rest = fields[2:]
+         d = int(rest[0]) if rest else 255
+         self.color = (r, g, b, d)
+         self.saved = {'dimmer': d, 'red': r, 'green': g, 'blue': b}
+      elif kind == 'params':
+         self.patterns = [parseParams(fields[1:])]
+      elif kind == 'alternate':
+         self.patterns = [parseParams(pattern.split())
+               for pattern in ' '.join(fields[1:]).split('/')]
+      else:
+         raise ValueError('Unknown scene type %s for %s' % (kind, name))
+      return
+
+class CompiledScene:
+   """
+   A scene's levels for a set of fixtures, merged into one run per block of
+   back to back fixtures on each output.
+   """
+
+   def apply(self):
+      """ Copy the scene's levels into the universe buffers. """
+      for output, start, data in self.runs:
+         output.setChannels(start, data)
+      for fixture, levels in self.levels:
+         fixture.effect = ''
+
+   def __init__(self, scene, levels):
+      self.scene = scene
+      self.levels = levels
+      # merge fixtures that sit back to back into single runs
+      runs = []
+      for fixture, data in sorted(levels, key=lambda entry: (id(entry[0].output), entry[0].channel)):
+         start = fixture.channel + 1
+         if runs and runs[-1][0] is fixture.output and runs[-1][1] + len(runs[-1][2]) == start:
+            runs[-1][2] += data
+         else:
+            runs.append([fixture.output, start, bytearray(data)])
+      self.runs = [(output, start, bytes(data)) for output, start, data in runs]
+      return
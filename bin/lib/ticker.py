@@ -0,0 +1,68 @@
+"""
+  Fixed-rate tick thread shared by the effect and fade engines.
+"""
+
+import threading, time
+
+from pysimpledmx.timing import runAtRate
+
+class Ticker:
+   """
+   Calls step() and then render() at a fixed rate, but only while there is
+   work: wake() starts the thread and it ends itself once step() reports
+   nothing is left. ticks, overruns and busy (seconds spent stepping and
+   rendering) show what it costs.
+
+   Given a call function, each tick is run through it, eg. to have it done
+   on another thread; call(function, elapsed) must return the result.
+   """
+
+   def step(self, elapsed):
+      """ Advance by one tick; elapsed is seconds since the thread started.
+      Return False when there is nothing left to do. Called under self.lock.
+      """
+      return False
+
+   def wake(self):
+      """ Make sure the tick thread is running. """
+      with self.lock:
+         if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+   def _tick(self, elapsed):
+      with self.lock:
+         busy = self.step(elapsed)
+         if not busy:
+            self.thread = None
+      self.render()
+      return busy
+
+   def _run(self):
+      runAtRate(self.interval, self._timed, overrun=self._overrun)
+
+   def _timed(self, elapsed):
+      start = time.monotonic()
+      if self.call:
+         busy = self.call(self._tick, elapsed)
+      else:
+         busy = self._tick(elapsed)
+      self.ticks += 1
+      self.busy += time.monotonic() - start
+      return busy
+
+   def _overrun(self):
+      self.overruns += 1
+
+   def __init__(self, render, rate=40, call=None):
+      """ render is called once per tick to put the frame on the wire. """
+      self.render = render
+      self.call = call
+      self.rate = rate
+      self.interval = 1.0 / rate
+      self.lock = threading.Lock()
+      self.thread = None
+      self.ticks = 0
+      self.overruns = 0
+      self.busy = 0.0
+      return
@@ -0,0 +1,147 @@
+'''
+Alternative DMX outputs sharing the DMXOutput frame handling.
+
+Besides the Enttec widget in pysimpledmx, a universe can be sent as E1.31
+(sACN) or Art-Net over the network, or to an in-memory sink for testing.
+'''
+
+import os, socket, threading
+
+from pysimpledmx.pysimpledmx import DMXOutput, DMXConnection, DMX_SIZE, LABELS, START_VAL, END_VAL
+
+ARTNET_PORT   = 6454
+ARTNET_HEADER = 18
+
+
+class SACNOutput(DMXOutput):
+  def __init__(self, universe = 1, destination = None, extent = None):
+    '''
+    Sends the universe as E1.31 using the sacn package. Multicasts unless a
+    unicast destination address is given.
+    '''
+    import sacn
+    DMXOutput.__init__(self, extent)
+    self.universe = universe
+    self.sender = sacn.sACNsender()
+    self.sender.start()
+    self.sender.activate_output(universe)
+    if destination:
+      self.sender[universe].destination = destination
+    else:
+      self.sender[universe].multicast = True
+
+  def transmit(self, packet, size):
+    self.sender[self.universe].dmx_data = bytes(packet[self.header:self.header + size])
+
+  def close(self):
+    DMXOutput.close(self)
+    self.sender.stop()
+
+
+class ArtNetOutput(DMXOutput):
+  # Art-Net frames carry an even number of slots
+  minimum = 2
+  header = ARTNET_HEADER
+
+  def __init__(self, host = '255.255.255.255', universe = 0, extent = None):
+    '''
+    Sends the universe as ArtDmx packets over UDP. universe is the 15 bit
+    Art-Net port address (net, sub-net and universe).
+    '''
+    DMXOutput.__init__(self, extent)
+    self.address = (host, ARTNET_PORT)
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    # ID, OpDmx (little endian), protocol 14, sequence 0 (off), physical 0
+    self.packet[0:14] = b'Art-Net\x00\x00\x50\x00\x0e\x00\x00'
+    self.packet[14] = universe & 0xFF
+    self.packet[15] = (universe >> 8) & 0x7F
+
+  def transmit(self, packet, size):
+    size += size & 1
+    packet[16] = (size >> 8) & 0xFF
+    packet[17] = size & 0xFF
+    self.sock.sendto(memoryview(packet)[:self.header + size], self.address)
+
+  def close(self):
+    DMXOutput.close(self)
+    self.sock.close()
+
+
+class NullOutput(DMXOutput):
+  def __init__(self, extent = None):
+    '''
+    Keeps the last transmitted frame in memory and counts frames sent.
+    '''
+    DMXOutput.__init__(self, extent)
+    self.frames = 0
+    self.last = bytearray(DMX_SIZE)
+    self.last_size = 0
+
+  def transmit(self, packet, size):
+    self.last[:size] = memoryview(packet)[self.header:self.header + size]
+    self.last_size = size
+    self.frames += 1
+
+
+class FakeWidget(object):
+  def __init__(self):
+    '''
+    A pseudo-terminal standing in for a USB DMX Pro. Open a DMXConnection on
+    self.port; everything written to it is drained and counted in self.bytes.
+    Parameter requests are answered, so getParameters() does not time out.
+    '''
+    self.master, self.slave = os.openpty()
+    self.port = os.ttyname(self.slave)
+    self.bytes = 0
+    # firmware version, break and mark-after-break in 10.67us ticks, rate
+    self.parameters = bytearray((0x44, 0x01, 9, 1, 40))
+    self.reader = threading.Thread(target=self._drain, daemon=True)
+    self.reader.start()
+
+  def _drain(self):
+    while True:
+      try:
+        data = os.read(self.master, 4096)
+      except OSError:
+        return
+      if not data:
+        return
+      self.bytes += len(data)
+      self._answer(data)
+
+  def _answer(self, data):
+    get = bytes((START_VAL, LABELS['GET_WIDGET_PARAMETERS'], 2, 0))
+    set = bytes((START_VAL, LABELS['SET_WIDGET_PARAMETERS'], 5, 0))
+    at = data.find(set)
+    if at >= 0 and len(data) >= at + 9:
+      self.parameters[2:5] = data[at + 6:at + 9]
+    if get in data:
+      reply = bytes((START_VAL, LABELS['GET_WIDGET_PARAMETERS'], 5, 0)) + self.parameters + bytes((END_VAL,))
+      os.write(self.master, reply)
+
+  def close(self):
+    os.close(self.slave)
+    os.close(self.master)
+
+
+def openOutput(options):
+  '''
+  Opens the output described by a config section or dict:
+      output      enttec (default), sacn, artnet or null
+      port        serial device for enttec
+      universe    universe number for sacn and artnet
+      destination unicast address for sacn, multicast if not given
+      host        destination address for artnet, broadcast if not given
+      extent      fixed number of channels to send
+  '''
+  kind = options.get('output', 'enttec')
+  extent = options.get('extent')
+  extent = int(extent) if extent else None
+  if kind == 'sacn':
+    return SACNOutput(int(options.get('universe', 1)), options.get('destination'), extent)
+  if kind == 'artnet':
+    return ArtNetOutput(options.get('host', '255.255.255.255'), int(options.get('universe', 0)), extent)
+  if kind == 'null':
+    return NullOutput(extent)
+  return DMXConnection(options.get('port', '/dev/ttyUSB0'), extent)
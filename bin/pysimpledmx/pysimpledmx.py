@@ -1,4 +1,8 @@
-import serial, sys, array
+#from pysimpledmx import *
+
+import serial, sys, threading
+
+from pysimpledmx.timing import runAtRate
 
 START_VAL   = 0x7E
 END_VAL     = 0xE7
@@ -7,74 +11,466 @@ COM_BAUD    = 57600
 COM_TIMEOUT = 1
 COM_PORT    = 7
 DMX_SIZE    = 512
+DMX_MIN     = 24   # shortest frame the widget will accept
+
+# widget break and mark-after-break times are counted in 10.67us ticks
+TIME_UNIT   = 10.67
+BREAK_RANGE = (9, 127)
+MAB_RANGE   = (1, 127)
+RATE_RANGE  = (0, 40)   # packets per second, 0 is as fast as possible
+
+# Enttec packet framing: start, label, length LSB, length MSB ... end
+HEADER_SIZE = 4
+FOOTER_SIZE = 1
+FOOTER      = bytes((END_VAL,))
 
 LABELS = {
-         'GET_WIDGET_PARAMETERS' :0x03,  #unused
-         'SET_WIDGET_PARAMETERS' :0x04,  #unused
-         'RX_DMX_PACKET'         :0x05,  #unused
+         'GET_WIDGET_PARAMETERS' :0x03,
+         'SET_WIDGET_PARAMETERS' :0x04,
+         'RX_DMX_PACKET'         :0x05,
          'TX_DMX_PACKET'         :0x06,
          'TX_RDM_PACKET_REQUEST' :0x07,  #unused
-         'RX_DMX_ON_CHANGE'      :0x08,  #unused
+         'RX_DMX_ON_CHANGE'      :0x08,
+         'RX_DMX_CHANGE_OF_STATE':0x09,
       }
 
+# change-of-state messages carry a 5 byte bitmap of changed slots per block
+COS_BLOCK   = 8
+COS_SLOTS   = 40
 
-class DMXConnection(object):
-  def __init__(self, comport = None):
+
+class DMXOutput(object):
+  '''
+  A single DMX universe held in a preallocated buffer, with dirty tracking,
+  trimmed frames and an optional fixed-rate output thread. Subclasses only
+  provide transmit(), which puts the first size slots of a frame on the wire.
+  '''
+  # shortest frame the output will send
+  minimum = 1
+  # bytes of framing room kept in front of the channel data
+  header = HEADER_SIZE
+  # optional callable run after every frame is written, eg. for latency
+  written = None
+
+  def __init__(self, extent = None):
     '''
-    On Windows, the only argument is the port number. On *nix, it's the path to the serial device.
-    For example:
-        DMXConnection(4)              # Windows
-        DMXConnection('/dev/tty2')    # Linux
-        DMXConnection("/dev/ttyUSB0") # Linux
+    Frames are only as long as needed to reach the highest channel ever set.
+    Pass extent to fix the frame length to a known patch size instead.
     '''
-    self.dmx_frame = [0] * DMX_SIZE
-    try:
-      self.com = serial.Serial(comport, baudrate = COM_BAUD, timeout = COM_TIMEOUT)
-    except:
-      com_name = 'COM%s' % (comport + 1) if type(comport) == int else comport
-      print("Could not open device %s. Quitting application." % com_name)
-      sys.exit(0)
+    # Channel data sits after self.header bytes of framing room. dmx_frame is
+    # a view onto it, so setting a channel writes straight into the buffer
+    # handed to transmit().
+    self.packet = bytearray(self.header + DMX_SIZE + FOOTER_SIZE)
+    self.dmx_frame = memoryview(self.packet)[self.header:self.header + DMX_SIZE]
+    # with the output thread running, render() publishes a copy of the frame
+    # and the thread transmits its own copy of that, so it only ever sends
+    # frames as they stood at a render, and callers never wait on the wire
+    self.published = bytearray(len(self.packet))
+    self.published_size = 0
+    self.publishes = 0
+    self.sends = 0
+    self.snapshot = bytearray(len(self.packet))
+    self.lock = threading.Lock()
+    self.output = None
+    # change counters behind self.dirty; nothing has been sent yet, so the
+    # first render always goes out
+    self.changes = 1
+    self.rendered = 0
+    self.fixed_extent = extent is not None
+    self.extent = 0
+    if self.fixed_extent:
+      self.setExtent(extent)
 
-    # print "Opened %s." % (self.com.portstr)
+  def transmit(self, packet, size):
+    '''
+    Sends slots 1..size of the frame held in packet. Implemented by each output.
+    '''
+    raise NotImplementedError
 
+  @property
+  def dirty(self):
+    '''
+    True while the frame holds changes that have not been sent. Writers set
+    it True after writing channel data; each change counts, so a change made
+    while a frame is being copied or sent is never lost, lock or no lock.
+    '''
+    return self.changes != self.rendered
+
+  @dirty.setter
+  def dirty(self, value):
+    if value:
+      self.changes += 1
+    else:
+      self.rendered = self.changes
 
   def setChannel(self, chan, val, autorender = False):
     '''
     Takes channel and value arguments to set a channel level in the local
     DMX frame, to be rendered the next time the render() method is called.
+    The frame is only marked dirty when the level actually changes.
     '''
     if not 1 <= chan <= DMX_SIZE:
       print('Invalid channel specified: %s' % chan)
       return
     # clamp value
     val = max(0, min(val, 255))
-    self.dmx_frame[chan-1] = val
+    with self.lock:
+      if chan > self.extent and not self.fixed_extent:
+        self.extent = chan
+      if self.dmx_frame[chan-1] != val:
+        self.dmx_frame[chan-1] = val
+        self.dirty = True
     if autorender: self.render()
 
+  def setChannels(self, start, values, autorender = False):
+    '''
+    Sets a block of consecutive channels beginning at start in one call.
+    Values may be bytes, a bytearray, a memoryview or a sequence of levels;
+    sequences are clamped to 0..255. The whole slice is checked once.
+    '''
+    count = len(values)
+    if count == 0:
+      return
+    if not (1 <= start and start + count - 1 <= DMX_SIZE):
+      print('Invalid channel range specified: %s-%s' % (start, start + count - 1))
+      return
+    if not isinstance(values, (bytes, bytearray, memoryview)):
+      try:
+        values = bytes(values)
+      except ValueError:
+        values = bytes(max(0, min(val, 255)) for val in values)
+    end = start + count - 1
+    with self.lock:
+      if end > self.extent and not self.fixed_extent:
+        self.extent = end
+      if self.dmx_frame[start-1:end] != values:
+        self.dmx_frame[start-1:end] = values
+        self.dirty = True
+    if autorender: self.render()
+
+  def view(self, start, count):
+    '''
+    Returns a writable view of count channels beginning at start, for callers
+    that keep their levels directly in the frame. Whoever writes through it
+    must set self.dirty for the change to be rendered.
+    '''
+    if not (1 <= start and count >= 0 and start + count - 1 <= DMX_SIZE):
+      raise ValueError('Invalid channel range specified: %s-%s' % (start, start + count - 1))
+    end = start + count - 1
+    with self.lock:
+      if end > self.extent and not self.fixed_extent:
+        self.extent = end
+    return self.dmx_frame[start-1:end]
+
   def clear(self, chan = 0):
     '''
     Clears all channels to zero. blackout.
     With optional channel argument, clears only one channel.
     '''
-    if chan == 0:
-      self.dmx_frame = [0] * DMX_SIZE
+    with self.lock:
+      if chan == 0:
+        self.dmx_frame[:] = bytes(DMX_SIZE)
+      else:
+        self.dmx_frame[chan-1] = 0
+      self.dirty = True
+
+  def setExtent(self, extent):
+    '''
+    Fixes the number of channels transmitted per frame to the patch size.
+    '''
+    if not 1 <= extent <= DMX_SIZE:
+      print('Invalid extent specified: %s' % extent)
+      return
+    with self.lock:
+      self.fixed_extent = True
+      self.extent = extent
+      self.dirty = True
+
+  def frameSize(self):
+    '''
+    Number of channel slots sent per frame, never shorter than the output allows.
+    '''
+    return max(self.extent, self.minimum)
+
+
+  def render(self, force = False):
+    '''
+    Sends the values in self.dmx_frame to the output.
+    Skips the write when nothing changed since the last render, unless forced.
+    When the output thread is running, the frame is published instead and
+    goes out on its next tick; changes made since are not seen until the
+    next render.
+    '''
+    if not (self.dirty or force):
+      return
+    if self.output is not None:
+      with self.lock:
+        mark = self.changes
+        size = self.frameSize()
+        end = self.header + size
+        self.published[:end] = memoryview(self.packet)[:end]
+        self.published_size = size
+        self.rendered = mark
+        self.publishes += 1
+      return
+    # changes made during the write will go out with the next render
+    mark = self.changes
+    self.transmit(self.packet, self.frameSize())
+    self.rendered = mark
+    if self.written: self.written()
+
+  def start(self, rate = 44):
+    '''
+    Refreshes the output from a background thread rate times a second.
+    render() only publishes the frame; any number of renders between two
+    ticks coalesce into a single write of the latest one.
+    '''
+    if self.output is not None:
+      return
+    self.interval = 1.0 / rate
+    self.stopped = threading.Event()
+    self.output = threading.Thread(target=self._refresh, daemon=True)
+    self.output.start()
+
+  def stop(self):
+    '''
+    Stops the output thread and returns to rendering synchronously.
+    '''
+    if self.output is None:
+      return
+    self.stopped.set()
+    self.output.join()
+    self.output = None
+    # a frame published but never sent goes out with the next render
+    if self.unsent():
+      self.sends = self.publishes
+      self.dirty = True
+
+  def _refresh(self):
+    runAtRate(self.interval, lambda elapsed: self._flush() or True, self.stopped)
+
+  def _flush(self):
+    with self.lock:
+      if self.sends == self.publishes:
+        return
+      size = self.published_size
+      end = self.header + size
+      self.snapshot[:end] = memoryview(self.published)[:end]
+      self.sends = self.publishes
+    self.transmit(self.snapshot, size)
+    if self.written: self.written()
+
+  def unsent(self):
+    '''
+    True while a rendered frame is still waiting for the output thread.
+    '''
+    return self.sends != self.publishes
+
+  def close(self):
+    self.stop()
+
+
+class DMXConnection(DMXOutput):
+  minimum = DMX_MIN
+
+  def __init__(self, comport = None, extent = None):
+    '''
+    On Windows, the only argument is the port number. On *nix, it's the path to the serial device.
+    For example:
+        DMXConnection(4)              # Windows
+        DMXConnection('/dev/tty2')    # Linux
+        DMXConnection("/dev/ttyUSB0") # Linux
+
+    Frames are only as long as needed to reach the highest channel ever set.
+    Pass extent to fix the frame length to a known patch size instead.
+    '''
+    DMXOutput.__init__(self, extent)
+    # the TX_DMX_PACKET framing is put in place once
+    self.packet[0] = START_VAL
+    self.packet[1] = LABELS['TX_DMX_PACKET']
+    self.packet[2] = DMX_SIZE & 0xFF
+    self.packet[3] = (DMX_SIZE >> 8) & 0xFF
+    self.packet[-1] = END_VAL
+    # filled in by getParameters()/setParameters()
+    self.parameters = None
+    # incoming DMX, maintained by the listen() thread
+    self.rx_frame = bytearray(DMX_SIZE)
+    self.reader = None
+    try:
+      self.com = serial.Serial(comport, baudrate = COM_BAUD, timeout = COM_TIMEOUT)
+    except:
+      com_name = 'COM%s' % (comport + 1) if type(comport) == int else comport
+      print("Could not open device %s. Quitting application." % com_name)
+      sys.exit(0)
+
+    # print "Opened %s." % (self.com.portstr)
+
+  def transmit(self, packet, size):
+    '''
+    Writes the frame to the USB DMX Pro as a TX_DMX_PACKET of size slots.
+    '''
+    packet[2] = size & 0xFF
+    packet[3] = (size >> 8) & 0xFF
+    if size == DMX_SIZE:
+      # the copies made for the output thread stop at the last slot, so the
+      # end marker is put back on whichever buffer is sent
+      packet[-1] = END_VAL
+      self.com.write(packet)
     else:
-      self.dmx_frame[chan-1] = 0
+      # the end marker follows as a write of its own; the channel data after
+      # the last slot is never touched
+      self.com.write(memoryview(packet)[:HEADER_SIZE + size])
+      self.com.write(FOOTER)
+
+  def sendMessage(self, label, data = b''):
+    '''
+    Writes a single Enttec API message with the given label and payload.
+    '''
+    size = len(data)
+    self.com.write(bytes((START_VAL, label, size & 0xFF, (size >> 8) & 0xFF)) + bytes(data) + bytes((END_VAL,)))
+
+  def nextMessage(self):
+    '''
+    Reads the next complete widget message and returns (label, payload).
+    Returns None if the widget goes quiet for COM_TIMEOUT.
+    '''
+    while True:
+      byte = self.com.read(1)
+      if not byte:
+        return None
+      if byte[0] != START_VAL:
+        continue
+      header = self.com.read(3)
+      if len(header) < 3:
+        return None
+      size = header[1] | (header[2] << 8)
+      data = self.com.read(size + FOOTER_SIZE)
+      if len(data) < size + FOOTER_SIZE:
+        return None
+      if data[-1] == END_VAL:
+        return header[0], data[:-1]
+
+  def readMessage(self, label):
+    '''
+    Reads widget messages until one with the given label arrives and returns
+    its payload. Returns None if the widget goes quiet for COM_TIMEOUT.
+    '''
+    while True:
+      message = self.nextMessage()
+      if message is None:
+        return None
+      if message[0] == label:
+        return message[1]
 
+  def getParameters(self):
+    '''
+    Asks the widget for its firmware version, break time, mark-after-break
+    time and output rate. Times are in microseconds. Returns the dict, which
+    is also kept in self.parameters, or None if the widget did not answer.
+    Call before start().
+    '''
+    self.sendMessage(LABELS['GET_WIDGET_PARAMETERS'], b'\x00\x00')
+    reply = self.readMessage(LABELS['GET_WIDGET_PARAMETERS'])
+    if reply is None or len(reply) < 5:
+      print('Widget did not report its parameters.')
+      return None
+    self.parameters = {
+      'firmware': reply[0] | (reply[1] << 8),
+      'break_time': round(reply[2] * TIME_UNIT, 2),
+      'mab_time': round(reply[3] * TIME_UNIT, 2),
+      'rate': reply[4],
+    }
+    return self.parameters
 
-  def render(self):
-    ''''
-    Updates the DMX output from the USB DMX Pro with the values from self.dmx_frame.
+  def setParameters(self, break_time = None, mab_time = None, rate = None):
     '''
-    packet = array.array('B')
-    packet.append(START_VAL)
-    packet.append(LABELS['TX_DMX_PACKET'])
-    packet.append(len(self.dmx_frame) & 0xFF)
-    packet.append((len(self.dmx_frame) >> 8) & 0xFF)
-    packet.fromlist(self.dmx_frame)
-    packet.append(END_VAL)
+    Sets the widget output timing. break_time and mab_time are in
+    microseconds, rate in packets per second (0 is as fast as possible).
+    Anything left as None keeps the last value read from the widget.
+    Values are clamped to what the widget supports. Call before start().
+    '''
+    current = self.parameters or self.getParameters() or {}
+    if break_time is None: break_time = current.get('break_time', 96)
+    if mab_time is None: mab_time = current.get('mab_time', TIME_UNIT)
+    if rate is None: rate = current.get('rate', 40)
+    ticks_break = max(BREAK_RANGE[0], min(int(round(break_time / TIME_UNIT)), BREAK_RANGE[1]))
+    ticks_mab = max(MAB_RANGE[0], min(int(round(mab_time / TIME_UNIT)), MAB_RANGE[1]))
+    rate = max(RATE_RANGE[0], min(int(rate), RATE_RANGE[1]))
+    self.sendMessage(LABELS['SET_WIDGET_PARAMETERS'], bytes((0, 0, ticks_break, ticks_mab, rate)))
+    # the widget does not acknowledge, so record what was sent
+    self.parameters = dict(current, break_time = round(ticks_break * TIME_UNIT, 2),
+                           mab_time = round(ticks_mab * TIME_UNIT, 2), rate = rate)
+    return self.parameters
+
+  def listen(self, callback = None, on_change = True):
+    '''
+    Starts a thread that reads DMX arriving at the widget input into
+    self.rx_frame. With on_change the widget only reports changed slots, and
+    callback(start, data) receives just the channels that changed, as the
+    first channel number and a view of that run in rx_frame. Otherwise every
+    received packet is delivered whole, starting at channel 1.
+    '''
+    if self.reader is not None:
+      return
+    self.rx_callback = callback
+    self.sendMessage(LABELS['RX_DMX_ON_CHANGE'], b'\x01' if on_change else b'\x00')
+    self.listening = threading.Event()
+    self.listening.set()
+    self.reader = threading.Thread(target=self._receive, daemon=True)
+    self.reader.start()
 
-    self.com.write(packet.tobytes())
+  def stopListening(self):
+    '''
+    Stops the input thread. Returns within COM_TIMEOUT.
+    '''
+    if self.reader is None:
+      return
+    self.listening.clear()
+    self.reader.join()
+    self.reader = None
+
+  def _receive(self):
+    frame = memoryview(self.rx_frame)
+    while self.listening.is_set():
+      message = self.nextMessage()
+      if message is None:
+        continue
+      label, data = message
+      if label == LABELS['RX_DMX_PACKET']:
+        # status byte, then the start code, then the channel data
+        if len(data) < 2 or data[0] or data[1]:
+          continue
+        count = min(len(data) - 2, DMX_SIZE)
+        frame[:count] = data[2:2 + count]
+        if self.rx_callback and count:
+          self.rx_callback(1, frame[:count])
+      elif label == LABELS['RX_DMX_CHANGE_OF_STATE']:
+        self._applyChanges(frame, data)
+
+  def _applyChanges(self, frame, data):
+    # slot 0 of the bitmap is the start code, so slot n is channel n
+    if len(data) < 6:
+      return
+    base = data[0] * COS_BLOCK
+    changed = data[1:6]
+    values = data[6:]
+    first = last = None
+    index = 0
+    for slot in range(COS_SLOTS):
+      if not changed[slot >> 3] & (1 << (slot & 7)):
+        continue
+      if index >= len(values):
+        break
+      chan = base + slot
+      if 1 <= chan <= DMX_SIZE:
+        frame[chan-1] = values[index]
+        if first is None: first = chan
+        last = chan
+      index += 1
+    if self.rx_callback and first is not None:
+      self.rx_callback(first, frame[first-1:last])
 
   def close(self):
+    DMXOutput.close(self)
+    self.stopListening()
     self.com.close()
@@ -0,0 +1,180 @@
+'''
+Recording rendered DMX frames to disk and playing them back.
+
+A recording is the MAGIC header followed by one record per changed frame:
+
+    <QHH  nanoseconds since the recording started, universe, run count
+    <HH   per run: first slot (0 based) and length, followed by the bytes
+
+The first record for each universe is a keyframe: one run holding its
+whole frame. After that, runs only cover the parts of a universe that
+changed since the previous record for that universe, in CHUNK sized
+pieces, so a static show costs nothing and a single fader move costs a
+few bytes.
+'''
+
+import mmap, struct, threading, time
+
+from pysimpledmx.pysimpledmx import DMX_SIZE
+
+MAGIC  = b'DMXR\x01'
+CHUNK  = 32
+RECORD = struct.Struct('<QHH')
+RUN    = struct.Struct('<HH')
+
+
+class FrameRecorder(object):
+  def __init__(self, path):
+    '''
+    Starts a new recording at path, replacing any recording already there.
+    Records after each universe's keyframe are changes against the one
+    before, all stamped from the start of this recording, so sessions
+    cannot share a file.
+    '''
+    self.file = open(path, 'wb')
+    self.file.write(MAGIC)
+    self.started = time.monotonic_ns()
+    self.previous = {}
+    self.buffer = bytearray()
+
+  def capture(self, universes):
+    '''
+    Records the current frame of every (universe, output) pair given,
+    writing only the chunks that differ from the last capture.
+    '''
+    now = time.monotonic_ns() - self.started
+    for universe, output in universes:
+      frame = output.dmx_frame
+      size = output.frameSize()
+      previous = self.previous.get(universe)
+      if previous is None:
+        # the keyframe, so playback starts from the recorded state and not
+        # from whatever the outputs held
+        self.previous[universe] = bytearray(frame)
+        self.file.write(RECORD.pack(now, universe, 1))
+        self.file.write(RUN.pack(0, size))
+        self.file.write(frame[:size])
+        continue
+      buffer = self.buffer
+      del buffer[:]
+      runs = 0
+      start = None
+      for offset in range(0, size, CHUNK):
+        end = min(offset + CHUNK, size)
+        if frame[offset:end] != previous[offset:end]:
+          if start is None:
+            start = offset
+          continue
+        if start is not None:
+          runs += self._run(frame, previous, start, offset)
+          start = None
+      if start is not None:
+        runs += self._run(frame, previous, start, size)
+      if runs:
+        self.file.write(RECORD.pack(now, universe, runs))
+        self.file.write(buffer)
+
+  def _run(self, frame, previous, start, end):
+    self.buffer += RUN.pack(start, end - start)
+    self.buffer += frame[start:end]
+    previous[start:end] = frame[start:end]
+    return 1
+
+  def close(self):
+    self.file.close()
+
+
+class FramePlayer(object):
+  def __init__(self, path, universes, post = None):
+    '''
+    Memory-maps the recording at path for playback onto universes, which
+    is a DMXUniverses or anything offering setChannels(start, values,
+    universe) and render(). Given a post function, each frame is applied
+    through post(function, *args) instead, eg. to have it done on the
+    thread that owns the universes; post must not wait for it.
+    '''
+    self.universes = universes
+    self.post = post
+    with open(path, 'rb') as show:
+      self.map = mmap.mmap(show.fileno(), 0, access=mmap.ACCESS_READ)
+    if self.map[:len(MAGIC)] != MAGIC:
+      raise ValueError('%s is not a DMX recording' % path)
+    # slots a universe's frame grew into after its keyframe; they were dark
+    # when the recording started, so each pass clears them with the keyframe
+    self.blank = {}
+    keyframes = {}
+    for stamp, universe, runs in self.frames():
+      end = max(start - 1 + len(values) for start, values in runs)
+      keyframe = keyframes.setdefault(universe, end)
+      if end > keyframe:
+        self.blank[universe] = (keyframe + 1, max(end, self.blank.get(universe, (0, 0))[1]))
+    self.stopped = threading.Event()
+    self.player = None
+
+  def frames(self):
+    '''
+    Yields (nanoseconds, universe, runs) for each record, where runs are
+    (channel, memoryview) pairs straight out of the mapped file.
+    '''
+    view = memoryview(self.map)
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(view):
+      stamp, universe, count = RECORD.unpack_from(view, offset)
+      offset += RECORD.size
+      runs = []
+      for _ in range(count):
+        start, length = RUN.unpack_from(view, offset)
+        offset += RUN.size
+        runs.append((start + 1, view[offset:offset + length]))
+        offset += length
+      yield stamp, universe, runs
+
+  def play(self, loop = False):
+    '''
+    Streams the recording to the outputs at its original timing in a
+    background thread.
+    '''
+    if self.player is not None and self.player.is_alive():
+      return
+    self.stopped.clear()
+    self.player = threading.Thread(target=self._play, args=(loop,), daemon=True)
+    self.player.start()
+
+  def _play(self, loop):
+    while True:
+      keyframes = set()
+      began = time.monotonic_ns()
+      for stamp, universe, runs in self.frames():
+        delay = (began + stamp - time.monotonic_ns()) / 1e9
+        if delay > 0 and self.stopped.wait(delay):
+          return
+        if self.stopped.is_set():
+          return
+        if universe not in keyframes:
+          keyframes.add(universe)
+          if universe in self.blank:
+            first, last = self.blank[universe]
+            runs = runs + [(first, bytes(last - first + 1))]
+        if self.post:
+          # the runs point into the mapped file, which may be closed first
+          self.post(self._apply, [(start, bytes(values)) for start, values in runs], universe)
+        else:
+          self._apply(runs, universe)
+      if not loop:
+        return
+
+  def _apply(self, runs, universe):
+    for start, values in runs:
+      self.universes.setChannels(start, values, universe)
+    self.universes.render()
+
+  def stop(self):
+    if self.player is None:
+      return
+    self.stopped.set()
+    self.player.join()
+    self.player = None
+
+  def close(self):
+    self.stop()
+    self.map.close()
@@ -0,0 +1,28 @@
+'''
+The fixed-rate loop shared by output threads and tick engines.
+'''
+
+import time
+
+
+def runAtRate(interval, tick, stopped = None, overrun = None):
+  '''
+  Calls tick(elapsed) every interval seconds, elapsed being the seconds
+  since the loop started, until tick returns False or the stopped event is
+  set. A tick that finishes late skips the missed ticks rather than
+  bursting to catch up, and calls overrun() if given.
+  '''
+  began = deadline = time.monotonic()
+  while not (stopped and stopped.is_set()):
+    if tick(time.monotonic() - began) is False:
+      return
+    deadline += interval
+    delay = deadline - time.monotonic()
+    if delay > 0:
+      if stopped:
+        stopped.wait(delay)
+      else:
+        time.sleep(delay)
+    else:
+      if overrun: overrun()
+      deadline = time.monotonic()
@@ -0,0 +1,94 @@
+'''
+Several DMX universes, each on its own output, driven as one.
+'''
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class DMXUniverses(object):
+  def __init__(self):
+    '''
+    Maps logical universe numbers to DMXOutput instances. Offers the same
+    setChannel/setChannels/render calls as a single output, with an extra
+    universe argument that defaults to 1.
+    '''
+    self.outputs = {}
+    self.pool = None
+
+  def add(self, universe, output):
+    '''
+    Patches an output in as the given logical universe.
+    '''
+    self.outputs[universe] = output
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None
+
+  def __getitem__(self, universe):
+    return self.outputs[universe]
+
+  def __contains__(self, universe):
+    return universe in self.outputs
+
+  def __iter__(self):
+    return iter(self.outputs.items())
+
+  def setChannel(self, chan, val, universe = 1, autorender = False):
+    self.outputs[universe].setChannel(chan, val, autorender)
+
+  def setChannels(self, start, values, universe = 1, autorender = False):
+    self.outputs[universe].setChannels(start, values, autorender)
+
+  def view(self, start, count, universe = 1):
+    return self.outputs[universe].view(start, count)
+
+  def clear(self, chan = 0, universe = None):
+    '''
+    Clears one universe, or all of them when no universe is given.
+    '''
+    if universe is None:
+      for output in self.outputs.values():
+        output.clear(chan)
+    else:
+      self.outputs[universe].clear(chan)
+
+  def render(self, force = False):
+    '''
+    Renders every dirty universe in one pass. Outputs running their own
+    thread have the frame published for their next tick; the rest are written
+    in parallel so one slow port does not hold back the others.
+    '''
+    pending = [output for output in self.outputs.values()
+               if output.output is None and (output.dirty or force)]
+    for output in self.outputs.values():
+      if output.output is not None:
+        output.render(force)
+    if len(pending) == 1:
+      pending[0].render(force)
+    elif pending:
+      if self.pool is None:
+        self.pool = ThreadPoolExecutor(max_workers=len(self.outputs))
+      # every port gets its write, then the first failure is raised as it
+      # would be with a single universe
+      futures = [self.pool.submit(output.render, force) for output in pending]
+      wait(futures)
+      for future in futures:
+        future.result()
+
+  def start(self, rate = 44):
+    '''
+    Gives every universe its own fixed-rate output thread.
+    '''
+    for output in self.outputs.values():
+      output.start(rate)
+
+  def stop(self):
+    for output in self.outputs.values():
+      output.stop()
+
+  def close(self):
+    for output in self.outputs.values():
+      output.close()
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None